@@ -0,0 +1,80 @@
+"""
+Measure how long importing the plugin takes, as MAP Client does for every plugin when it starts.
+
+The package is imported in a fresh interpreter with -X importtime, the best of
+several runs is reported.  Fails if a module that is only needed once the step
+is configured or executed was imported, or if the import exceeds the budget.
+
+    python benchmarks/import_time.py [--repeat N] [--budget MILLISECONDS]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PACKAGE = "mapclientplugins.retrieveportaldatastep"
+# Imported when the step is configured or executed, never at startup.
+DEFERRED_MODULES = [
+    f"{PACKAGE}.configuredialog",
+    f"{PACKAGE}.ui_configuredialog",
+    f"{PACKAGE}.retrieveportaldatawidget",
+    f"{PACKAGE}.ui_retrieveportaldatawidget",
+    f"{PACKAGE}.filebrowsermodel",
+    f"{PACKAGE}.downloadscheduler",
+    f"{PACKAGE}.engine",
+    f"{PACKAGE}.asyncdownload",
+    f"{PACKAGE}.transport",
+    "requests",
+    "aiohttp",
+]
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _import_times():
+    """
+    Return the cumulative import time in microseconds of each module imported with the package.
+    """
+    environment = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPOSITORY_DIR,
+                                                                            os.environ.get("PYTHONPATH")])))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {PACKAGE}"],
+                            env=environment, capture_output=True, text=True)
+    if result.returncode:
+        sys.exit(f"Importing {PACKAGE} failed:\n{result.stderr}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(cumulative)
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs, the best is reported")
+    parser.add_argument("--budget", type=float, help="fail if the import takes longer, in milliseconds")
+    arguments = parser.parse_args()
+
+    best = None
+    for _ in range(max(1, arguments.repeat)):
+        times = _import_times()
+        deferred = [module for module in DEFERRED_MODULES if module in times]
+        if deferred:
+            print(f"Imported at startup: {', '.join(deferred)}")
+            return 1
+        if best is None or times[PACKAGE] < best:
+            best = times[PACKAGE]
+
+    milliseconds = best / 1000
+    print(f"Importing {PACKAGE} took {milliseconds:.1f} ms")
+    if arguments.budget is not None and milliseconds > arguments.budget:
+        print(f"Over the budget of {arguments.budget:.1f} ms")
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,9 +8,13 @@ __author__ = 'Kay Wang'
 __stepname__ = 'Retrieve Portal Data'
 __location__ = 'https://github.com/mapclient-plugins/mapclientplugins.retrieveportaldatastep'
 
-# import class that derives itself from the step mountpoint.
-from mapclientplugins.retrieveportaldatastep import step
+import importlib.util
 
-# Import the resource file when the module is loaded,
-# this enables the framework to use the step icon.
-from . import resources_rc
+# Without MAP Client, as when retrieving data from the command line, there is no step to register.
+if importlib.util.find_spec('mapclient') is not None:
+    # import class that derives itself from the step mountpoint.
+    from mapclientplugins.retrieveportaldatastep import step
+
+    # Import the resource file when the module is loaded,
+    # this enables the framework to use the step icon.
+    from . import resources_rc
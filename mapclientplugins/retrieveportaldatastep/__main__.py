@@ -0,0 +1,96 @@
+"""
+Search the SPARC portal and download files without a display.
+
+Files are downloaded into the same layout, and recorded in the same manifest,
+as the Retrieve Portal Data step, so data prefetched here is picked up by the
+step when it is next executed with the same output directory and settings file.
+"""
+import argparse
+import os
+import signal
+import sys
+import threading
+
+from mapclientplugins.retrieveportaldatastep.engine import scicrunch_search_pages, pennsieve_file_search_pages, \
+    standardise_doi_form, search_result_item, download_items, form_local_destination, set_search_cache_directory, \
+    SEARCH_CACHE_DIRNAME, DEFAULT_MAX_DOWNLOADS
+from mapclientplugins.retrieveportaldatastep.searchcache import OfflineCacheMiss
+
+SEARCH_TYPES = ["DOI", "mimetype", "filename"]
+# Hidden, so that the file browser of a step using the same output directory does not list it.
+DEFAULT_SETTINGS_FILENAME = ".retrieveportaldata-settings.json"
+
+
+def _parse_arguments(argv):
+    parser = argparse.ArgumentParser(
+        prog="python -m mapclientplugins.retrieveportaldatastep",
+        description="Search the SPARC portal and download the matching files.")
+    parser.add_argument("search_type", choices=SEARCH_TYPES, help="what to search by")
+    parser.add_argument("search_text", help="DOI, mimetype or filename to search for")
+    parser.add_argument("--dataset-id", default="", help="restrict a filename search to a dataset")
+    parser.add_argument("--species", action="append", default=[], help="species facet of a mimetype search")
+    parser.add_argument("--organ", action="append", default=[], help="organ facet of a mimetype search")
+    parser.add_argument("-o", "--output-dir", default=os.getcwd(), help="directory to download into")
+    parser.add_argument("--settings", help="step settings file the manifest is kept in, "
+                                           f"defaults to {DEFAULT_SETTINGS_FILENAME} in the output directory")
+    parser.add_argument("--cache-dir", help="directory to cache search results in, "
+                                            f"defaults to {SEARCH_CACHE_DIRNAME} in the temporary directory")
+    parser.add_argument("--offline", action="store_true", help="only use cached search results")
+    parser.add_argument("--max-downloads", type=int, default=DEFAULT_MAX_DOWNLOADS,
+                        help="number of files downloaded at the same time")
+    parser.add_argument("--list", action="store_true", help="list the matching files without downloading them")
+    return parser.parse_args(argv)
+
+
+def _search_pages(arguments):
+    if arguments.search_type == "filename":
+        return pennsieve_file_search_pages(arguments.search_text, arguments.dataset_id, arguments.offline)
+    if arguments.search_type == "mimetype":
+        facets = {'species': arguments.species, 'organ': arguments.organ}
+        return scicrunch_search_pages(arguments.search_text, arguments.search_type, facets, arguments.offline)
+
+    return scicrunch_search_pages(standardise_doi_form(arguments.search_text), arguments.search_type,
+                                  offline=arguments.offline)
+
+
+def main(argv=None):
+    arguments = _parse_arguments(argv)
+    output_dir = os.path.abspath(arguments.output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    settings_filename = arguments.settings or os.path.join(output_dir, DEFAULT_SETTINGS_FILENAME)
+    if arguments.cache_dir:
+        set_search_cache_directory(arguments.cache_dir)
+
+    try:
+        items = [search_result_item(file_info) for page in _search_pages(arguments) for file_info in page]
+    except OfflineCacheMiss:
+        print("No cached results for this search, search again without --offline.", file=sys.stderr)
+        return 1
+
+    if arguments.list or not items:
+        for item in items:
+            print(os.path.relpath(form_local_destination(output_dir, item), output_dir))
+        print(f"{len(items)} file{'' if len(items) == 1 else 's'} found.", file=sys.stderr)
+        return 0
+
+    cancel_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: cancel_event.set())
+
+    def on_finished(local_destination, item_data_str):
+        if local_destination != "error":
+            print(os.path.relpath(local_destination, output_dir))
+
+    failures = download_items(items, output_dir, settings_filename, arguments.max_downloads, cancel_event,
+                              finished=on_finished)
+    if cancel_event.is_set():
+        print("Downloads cancelled, run the same command again to resume them.", file=sys.stderr)
+        return 130
+    if failures:
+        print(f"{failures} file{'' if failures == 1 else 's'} failed to download.", file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+Download engine running every transfer on a single asyncio event loop.
+
+The thread pool engine ties up a thread for as long as a file is streaming,
+here hundreds of metadata lookups and transfers share one event loop thread.
+Files are written by a small pool of writer threads, a chunk is only read from
+the network once the previous chunk of the same file has been written and the
+writers have room, so a slow disk holds back the transfers rather than
+buffering them in memory.  Progress and completion are reported through the
+same callables as the thread pool downloaders, from the event loop thread.
+
+Needs aiohttp, see available().
+"""
+import asyncio
+import concurrent.futures
+import json
+import threading
+import time
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from mapclientplugins.retrieveportaldatastep.engine import FileDownloader, downloaded_item, partial_filename, \
+    zipit_request, transfer_headers, transfer_start, TransferProgress, PENNSIEVE_ZIPIT_URL, DOWNLOAD_CHUNK_SIZE
+from mapclientplugins.retrieveportaldatastep.filemetadata import dataset_file_path, dataset_files_endpoint, \
+    listing_key, listing_endpoint, listing_params, add_listing_page, listed_metadata, DEFAULT_TTL, LISTING_PAGE_SIZE
+
+DEFAULT_MAX_ASYNC_DOWNLOADS = 256
+# Threads hashing and writing files for the event loop.
+DISK_WORKERS = 4
+# Chunks handed to the writer threads but not yet written, across all transfers.
+MAX_QUEUED_WRITES = 64
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 30
+
+
+def available():
+    return aiohttp is not None
+
+
+def _ignore(*args):
+    pass
+
+
+class _ResolvedMetadata(object):
+    # Stands in for the metadata resolver of a downloader, the metadata was looked up on the event loop.
+
+    def __init__(self, metadata):
+        self._metadata = metadata
+
+    def resolve(self, item):
+        return self._metadata
+
+
+class _AsyncMetadataResolver(object):
+    """
+    Resolve file metadata from directory listings, as FileMetadataResolver does, on the event loop.
+    Concurrent lookups of the same directory share one listing request.
+    """
+
+    def __init__(self, session, ttl=DEFAULT_TTL, page_size=LISTING_PAGE_SIZE):
+        self._session = session
+        self._ttl = ttl
+        self._page_size = page_size
+        self._listings = {}
+
+    async def _get_json(self, url, params):
+        async with self._session.get(url, params=params) as response:
+            if response.status != 200:
+                return None
+            return await response.json(content_type=None)
+
+    async def _fetch_listing(self, item):
+        listing = {}
+        offset = 0
+        while offset is not None:
+            json_data = await self._get_json(listing_endpoint(item), listing_params(item, offset, self._page_size))
+            if json_data is None:
+                break
+
+            offset = add_listing_page(listing, json_data, offset)
+
+        return listing
+
+    def _listing(self, item):
+        key = listing_key(item)
+        cached = self._listings.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        listing = asyncio.ensure_future(self._fetch_listing(item))
+        self._listings[key] = (time.monotonic() + self._ttl, listing)
+        return listing
+
+    async def resolve(self, item):
+        path = dataset_file_path(item)
+        try:
+            listing = await asyncio.shield(self._listing(item))
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            listing = {}
+
+        metadata = listed_metadata(listing, path)
+        if metadata is None:
+            metadata = await self._get_json(dataset_files_endpoint(item), {'path': path})
+            if metadata is None:
+                raise aiohttp.ClientError(f"No metadata for {path}")
+            listing[path] = metadata
+
+        return metadata
+
+
+class AsyncDownloadEngine(object):
+    """
+    Run downloads on an event loop thread of their own, started when the first batch is submitted.
+
+    :param max_concurrent: Number of files being looked up or transferred at the same time.
+    :param max_per_host: Number of connections open to the same host, no limit if None.
+    """
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_ASYNC_DOWNLOADS, max_per_host=None):
+        self._max_concurrent = max(1, max_concurrent)
+        self._max_per_host = 0 if max_per_host is None else max(1, min(max_per_host, self._max_concurrent))
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._resolver = None
+        self._slots = None
+        self._write_slots = None
+        self._disk_executor = None
+
+    def _start(self):
+        with self._lock:
+            if self._loop is not None:
+                return
+
+            self._loop = asyncio.new_event_loop()
+            self._disk_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DISK_WORKERS)
+            self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+            self._thread.start()
+
+    def _open_session(self):
+        # Created on first use, from the event loop, which the session and semaphores belong to.
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._max_concurrent, limit_per_host=self._max_per_host)
+            timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            self._resolver = _AsyncMetadataResolver(self._session)
+            self._slots = asyncio.Semaphore(self._max_concurrent)
+            self._write_slots = asyncio.Semaphore(MAX_QUEUED_WRITES)
+
+    def submit(self, items, output_dir, cancel_event: threading.Event, hash_cache=None, object_store=None,
+               progress=None, finished=None):
+        """
+        Download items, reporting as FileDownloader does, and return a concurrent.futures.Future
+        that completes when every item has finished or cancel_event is set.
+        """
+        self._start()
+        return asyncio.run_coroutine_threadsafe(
+            self._download_batch(items, output_dir, cancel_event, hash_cache, object_store, progress or _ignore,
+                                 finished or _ignore), self._loop)
+
+    def close(self):
+        with self._lock:
+            if self._loop is None:
+                return
+
+            if self._session is not None:
+                asyncio.run_coroutine_threadsafe(self._session.close(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._disk_executor.shutdown()
+            self._loop = None
+            self._session = None
+
+    async def _download_batch(self, items, output_dir, cancel_event, hash_cache, object_store, progress, finished):
+        self._open_session()
+        await asyncio.gather(*(self._download(item, output_dir, cancel_event, hash_cache, object_store, progress,
+                                              finished) for item in items))
+
+    def _run_blocking(self, function, *args):
+        return asyncio.get_running_loop().run_in_executor(self._disk_executor, function, *args)
+
+    async def _download(self, item, output_dir, cancel_event, hash_cache, object_store, progress, finished):
+        local_destination = "error"
+        was_cancelled = False
+        finished_item = item
+        try:
+            async with self._slots:
+                # Items still waiting for a slot when the batch is cancelled never start.
+                if cancel_event.is_set():
+                    was_cancelled = True
+                    return
+
+                metadata = await self._resolver.resolve(item)
+                downloader = FileDownloader(item, output_dir, cancel_event, hash_cache, _ResolvedMetadata(metadata),
+                                            object_store)
+                local_destination, json_data, transfer_required = await self._run_blocking(downloader.prepare)
+                if transfer_required:
+                    file_size = json_data.get('size', 0)
+                    resume_from = await self._run_blocking(downloader.start_transfer, local_destination, json_data)
+                    if not (file_size and resume_from == file_size):
+                        was_cancelled = await self._transfer(item, local_destination, resume_from, cancel_event,
+                                                             progress)
+
+                    if not was_cancelled and not await self._run_blocking(downloader.complete_transfer,
+                                                                          local_destination, json_data):
+                        local_destination = "error"
+                finished_item = downloaded_item(item, json_data)
+
+        except Exception as e:
+            print("Handling unknown exception in AsyncDownloadEngine:")
+            print(e)
+
+        finally:
+            # A cancelled download leaves its partial file in place so that it can be resumed later.
+            if not was_cancelled:
+                finished(local_destination, json.dumps(finished_item))
+
+    def _write(self, f, chunk):
+        write = self._run_blocking(f.write, chunk)
+        write.add_done_callback(lambda _: self._write_slots.release())
+        return write
+
+    async def _transfer(self, item, local_destination, resume_from, cancel_event, progress):
+        req = zipit_request(item, [dataset_file_path(item)])
+        async with self._session.post(PENNSIEVE_ZIPIT_URL, json=req, headers=transfer_headers(resume_from)) as response:
+            response.raise_for_status()
+
+            resume_from, mode = transfer_start(response.status, resume_from)
+            transfer_progress = TransferProgress(progress, local_destination, resume_from)
+            f = await self._run_blocking(open, partial_filename(local_destination), mode)
+            write = None
+            try:
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    if cancel_event.is_set():
+                        return True
+
+                    # Writes of one file stay in order, the next chunk is received while this one is written.
+                    if write is not None:
+                        await write
+                    await self._write_slots.acquire()
+                    write = self._write(f, chunk)
+                    transfer_progress.add(len(chunk))
+
+                if write is not None:
+                    await write
+            finally:
+                if write is not None and not write.done():
+                    await asyncio.wait([write])
+                await self._run_blocking(f.close)
+
+        return False
@@ -0,0 +1,125 @@
+"""
+Completion of search text from the search history.
+
+Every suffix of every value is kept in a sorted list, the values containing
+some text are then found with a binary search for the suffixes starting with
+that text.  Matches are ranked by the same frequency and recency ranking as
+the search history.  The index is loaded from the history once, on a
+background thread, and kept up to date as searches are made.
+"""
+import bisect
+import heapq
+import threading
+import time
+
+from mapclientplugins.retrieveportaldatastep.searchhistory import rank
+
+DEFAULT_COMPLETIONS = 20
+_LAST_CHARACTER = chr(0x10FFFF)
+
+
+class _SuffixIndex(object):
+
+    def __init__(self):
+        self._suffixes = []
+        self._usage = {}
+
+    def _add_usage(self, value, count, last_used):
+        usage = self._usage.get(value)
+        if usage is not None:
+            usage[0] = max(usage[0], count)
+            usage[1] = max(usage[1], last_used)
+            return False
+
+        self._usage[value] = [count, last_used]
+        return True
+
+    def add(self, value, count, last_used):
+        if self._add_usage(value, count, last_used):
+            lowered = value.lower()
+            for start in range(len(lowered)):
+                bisect.insort(self._suffixes, (lowered[start:], value))
+
+    def add_all(self, usage):
+        """
+        Add many (value, count, last_used) at once, sorting the suffixes once at the end.
+        """
+        for value, count, last_used in usage:
+            if self._add_usage(value, count, last_used):
+                lowered = value.lower()
+                self._suffixes.extend((lowered[start:], value) for start in range(len(lowered)))
+        self._suffixes.sort()
+
+    def record(self, value, now):
+        usage = self._usage.get(value)
+        if usage is None:
+            self.add(value, 1, now)
+        else:
+            usage[0] += 1
+            usage[1] = now
+
+    def complete(self, text, limit, now):
+        key = text.lower()
+        start = bisect.bisect_left(self._suffixes, (key,))
+        # Every suffix starting with key sorts before key followed by the largest character.
+        end = bisect.bisect_left(self._suffixes, (key + _LAST_CHARACTER,), start)
+        matches = {value for _, value in self._suffixes[start:end]}
+
+        usage = self._usage
+        return heapq.nlargest(limit, matches, key=lambda match: rank(usage[match][0], usage[match][1], now))
+
+
+class CompletionEngine(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def _index(self, kind):
+        index = self._indexes.get(kind)
+        if index is None:
+            index = _SuffixIndex()
+            self._indexes[kind] = index
+
+        return index
+
+    def load(self, usage):
+        """
+        Add the values of usage, an iterable of (kind, value, count, last_used).
+        """
+        kinds = {}
+        for kind, value, count, last_used in usage:
+            kinds.setdefault(kind, []).append((value, count, last_used))
+
+        with self._lock:
+            for kind, kind_usage in kinds.items():
+                self._index(kind).add_all(kind_usage)
+
+    def load_in_background(self, search_history):
+        def _load():
+            try:
+                self.load(search_history.usage())
+            except Exception as e:
+                print("Handling unknown exception while loading the search history:")
+                print(e)
+
+        thread = threading.Thread(target=_load, daemon=True)
+        thread.start()
+
+    def record(self, kind, value):
+        if not value:
+            return
+
+        with self._lock:
+            self._index(kind).record(value, time.time())
+
+    def complete(self, kind, text, limit=DEFAULT_COMPLETIONS):
+        """
+        Return up to limit values of kind containing text, best ranked first.
+        """
+        if not text:
+            return []
+
+        with self._lock:
+            index = self._indexes.get(kind)
+            return [] if index is None else index.complete(text, limit, time.time())
@@ -2,15 +2,15 @@ import os
 
 from PySide6 import QtWidgets
 from mapclientplugins.retrieveportaldatastep.ui_configuredialog import Ui_ConfigureDialog
-
-from mapclient.settings.general import get_data_directory
+from mapclientplugins.retrieveportaldatastep.stepsettings import local_output_directory, global_output_directory, \
+    resolve_output_directory, output_directory_valid, DEFAULT_MAX_CONCURRENT_DOWNLOADS, \
+    DEFAULT_MAX_DOWNLOADS_PER_HOST, DEFAULT_MAX_ASYNC_DOWNLOADS, DEFAULT_MAX_ASYNC_DOWNLOADS_PER_HOST, \
+    MAX_ASYNC_DOWNLOADS, SOURCE_FILESYSTEM, SOURCE_MANIFEST
 
 INVALID_STYLE_SHEET = 'background-color: rgba(239, 0, 0, 50)'
 DEFAULT_STYLE_SHEET = ''
-
-
-def _global_output_directory():
-    return os.path.join(get_data_directory(), 'retrieveportaldata-downloads')
+# In the order of the file browser combo box.
+FILE_BROWSER_SOURCES = [SOURCE_FILESYSTEM, SOURCE_MANIFEST]
 
 
 class ConfigureDialog(QtWidgets.QDialog):
@@ -34,6 +34,10 @@ class ConfigureDialog(QtWidgets.QDialog):
 
         self._workflow_location = None
         self._previous_location = ''
+        # The download limits spin boxes edit the limits of the downloads selected by the event loop check box.
+        self._thread_download_limits = (DEFAULT_MAX_CONCURRENT_DOWNLOADS, DEFAULT_MAX_DOWNLOADS_PER_HOST)
+        self._async_download_limits = (DEFAULT_MAX_ASYNC_DOWNLOADS, DEFAULT_MAX_ASYNC_DOWNLOADS_PER_HOST)
+        self._thread_download_maximum = self._ui.spinBoxConcurrentDownloads.maximum()
 
         self._make_connections()
 
@@ -43,6 +47,24 @@ class ConfigureDialog(QtWidgets.QDialog):
     def _make_connections(self):
         self._ui.lineEdit0.textEdited.connect(self.validate)
         self._ui.pushButtonOutputDirectory.clicked.connect(self._directory_chooser_clicked)
+        self._ui.checkBoxAsyncioDownloads.toggled.connect(self._asyncio_downloads_toggled)
+
+    def _download_limits(self):
+        return self._ui.spinBoxConcurrentDownloads.value(), self._ui.spinBoxDownloadsPerHost.value()
+
+    def _show_download_limits(self, asyncio_downloads):
+        maximum = MAX_ASYNC_DOWNLOADS if asyncio_downloads else self._thread_download_maximum
+        limits = self._async_download_limits if asyncio_downloads else self._thread_download_limits
+        for spin_box, value in zip([self._ui.spinBoxConcurrentDownloads, self._ui.spinBoxDownloadsPerHost], limits):
+            spin_box.setMaximum(maximum)
+            spin_box.setValue(value)
+
+    def _asyncio_downloads_toggled(self, checked):
+        if checked:
+            self._thread_download_limits = self._download_limits()
+        else:
+            self._async_download_limits = self._download_limits()
+        self._show_download_limits(checked)
 
     def _directory_chooser_clicked(self):
         # Second parameter returned is the filter chosen
@@ -103,12 +125,7 @@ class ConfigureDialog(QtWidgets.QDialog):
         return valid and self._directory_valid()
 
     def _output_location_abspath(self):
-        dir_path = self._output_location()
-
-        if self._workflow_location:
-            dir_path = os.path.realpath(os.path.join(self._workflow_location, dir_path))
-
-        return dir_path
+        return resolve_output_directory(self._output_location(), self._workflow_location)
 
     def _make_output_directory(self):
         dir_path = self._output_location_abspath()
@@ -117,12 +134,7 @@ class ConfigureDialog(QtWidgets.QDialog):
 
     def _directory_valid(self):
         self._ui.comboBoxOutputDirectory.setItemText(0, self._local_output_directory())
-        dir_path = self._output_location_abspath()
-
-        output_directory_exists = os.path.isdir(dir_path)
-        output_directory_exists_as_a_file = os.path.isfile(dir_path)
-
-        directory_valid = (output_directory_exists or not output_directory_exists_as_a_file) and len(self._ui.comboBoxOutputDirectory.currentText())
+        directory_valid = output_directory_valid(self._output_location(), self._workflow_location)
         self._ui.comboBoxOutputDirectory.setStyleSheet(DEFAULT_STYLE_SHEET if directory_valid else INVALID_STYLE_SHEET)
 
         return directory_valid
@@ -137,10 +149,21 @@ class ConfigureDialog(QtWidgets.QDialog):
         output_directories = []
         for i in range(2, self._ui.comboBoxOutputDirectory.count()):
             output_directories.append(self._ui.comboBoxOutputDirectory.itemText(i))
+        asyncio_downloads = self._ui.checkBoxAsyncioDownloads.isChecked()
+        if asyncio_downloads:
+            self._async_download_limits = self._download_limits()
+        else:
+            self._thread_download_limits = self._download_limits()
         config = {
             'identifier': self._ui.lineEdit0.text(),
             'output-directory-index': self._ui.comboBoxOutputDirectory.currentIndex(),
             'output-directories': output_directories,
+            'max-concurrent-downloads': self._thread_download_limits[0],
+            'max-downloads-per-host': self._thread_download_limits[1],
+            'max-async-downloads': self._async_download_limits[0],
+            'max-async-downloads-per-host': self._async_download_limits[1],
+            'asyncio-downloads': asyncio_downloads,
+            'file-browser-source': FILE_BROWSER_SOURCES[self._ui.comboBoxFileBrowserSource.currentIndex()],
         }
         if self._previous_location:
             config['previous-location'] = os.path.relpath(self._previous_location, self._workflow_location)
@@ -150,7 +173,7 @@ class ConfigureDialog(QtWidgets.QDialog):
         return config
 
     def _local_output_directory(self):
-        return f'{self._ui.lineEdit0.text()}-downloads'
+        return local_output_directory(self._ui.lineEdit0.text())
 
     def get_output_directory(self):
         return self._output_location_abspath()
@@ -164,11 +187,23 @@ class ConfigureDialog(QtWidgets.QDialog):
         self._previousIdentifier = config['identifier']
         self._ui.lineEdit0.setText(config['identifier'])
         self._ui.comboBoxOutputDirectory.addItem(self._local_output_directory())
-        self._ui.comboBoxOutputDirectory.addItem(_global_output_directory())
+        self._ui.comboBoxOutputDirectory.addItem(global_output_directory())
         for output_directory in config.get('output-directories', []):
             self._ui.comboBoxOutputDirectory.addItem(output_directory)
 
         self._ui.comboBoxOutputDirectory.setCurrentIndex(config.get('output-directory-index', 0))
+        self._thread_download_limits = (config.get('max-concurrent-downloads', DEFAULT_MAX_CONCURRENT_DOWNLOADS),
+                                        config.get('max-downloads-per-host', DEFAULT_MAX_DOWNLOADS_PER_HOST))
+        self._async_download_limits = (config.get('max-async-downloads', DEFAULT_MAX_ASYNC_DOWNLOADS),
+                                       config.get('max-async-downloads-per-host', DEFAULT_MAX_ASYNC_DOWNLOADS_PER_HOST))
+        asyncio_downloads = config.get('asyncio-downloads', False)
+        self._ui.checkBoxAsyncioDownloads.blockSignals(True)
+        self._ui.checkBoxAsyncioDownloads.setChecked(asyncio_downloads)
+        self._ui.checkBoxAsyncioDownloads.blockSignals(False)
+        self._show_download_limits(asyncio_downloads)
+        file_browser_source = config.get('file-browser-source', SOURCE_FILESYSTEM)
+        self._ui.comboBoxFileBrowserSource.setCurrentIndex(
+            FILE_BROWSER_SOURCES.index(file_browser_source) if file_browser_source in FILE_BROWSER_SOURCES else 0)
 
         if 'previous-location' in config:
             self._previous_location = os.path.join(self._workflow_location, config['previous-location'])
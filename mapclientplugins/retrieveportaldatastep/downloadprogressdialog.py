@@ -1,58 +1,150 @@
+import collections
 import json
 import os.path
+import time
 
 from PySide6.QtWidgets import QDialog, QVBoxLayout, QLabel, QProgressBar
 from PySide6.QtCore import Slot, Qt, QTimer
 
+# Progress signals only update counters, the dialog is redrawn at this rate.
+PROGRESS_FRAME_RATE = 15
+PROGRESS_STEPS = 1000
+# Seconds of progress the throughput is averaged over.
+THROUGHPUT_WINDOW = 5.0
+# Weight of a file whose size is not known, when no other file size is known either.
+ESTIMATED_FILE_SIZE = 1024 * 1024
+
+
+def _format_bytes(size):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+
+    return f"{size:.1f} TB"
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+
+    return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+
 
 class DownloadProgressDialog(QDialog):
+    """
+    Progress of a batch of downloads weighted by file size.
 
-    def __init__(self, total_files, parent=None):
+    :param items: Items being downloaded.
+    :param destination_of: Callable taking an item returning its local destination,
+        the file path progress is reported against.
+    """
+
+    def __init__(self, items, destination_of, parent=None):
         super().__init__(parent)
         self.setWindowTitle("Downloading Files")
         self.setWindowModality(Qt.WindowModality.ApplicationModal)
         self.resize(400, 100)
 
-        self.total_files = total_files
-        self._individual_progress = [0] * self.total_files
-        self._seen_file = {}
+        self._destination_of = destination_of
+        known_sizes = [item['size'] for item in items if item.get('size')]
+        estimated_size = sum(known_sizes) // len(known_sizes) if known_sizes else ESTIMATED_FILE_SIZE
+        self._weights = {destination_of(item): item.get('size') or estimated_size for item in items}
+        self.total_files = len(self._weights)
+        self._total_bytes = sum(self._weights.values())
+        self._received = {}
+        self._bytes_done = 0
+        self._bytes_transferred = 0
+        self._finished = set()
         self._errors = 0
+        self._last_downloaded = None
+        self._samples = collections.deque()
 
         layout = QVBoxLayout(self)
         self._label = QLabel("Starting downloads...", self)
         self._progress_bar = QProgressBar(self)
-        self._progress_bar.setMaximum(total_files)
+        self._progress_bar.setMaximum(PROGRESS_STEPS)
         self._progress_bar.setValue(0)
+        self._rate_label = QLabel("", self)
 
         layout.addWidget(self._label)
         layout.addWidget(self._progress_bar)
+        layout.addWidget(self._rate_label)
+
+        self._refresh_timer = QTimer(self)
+        self._refresh_timer.setInterval(1000 // PROGRESS_FRAME_RATE)
+        self._refresh_timer.timeout.connect(self._refresh)
+        self._refresh_timer.start()
 
-    def _update_progress_bar(self):
-        self._progress_bar.setValue(sum(self._individual_progress))
+    def _count(self, file_path, received):
+        previous = self._received.get(file_path, 0)
+        self._bytes_done += received - previous
+        self._received[file_path] = received
+        return received - previous
 
-    def _register_file_path(self, file_path):
-        if file_path not in self._seen_file:
-            file_index = len(self._seen_file)
-            self._seen_file[file_path] = file_index
+    def _throughput(self):
+        now = time.monotonic()
+        self._samples.append((now, self._bytes_transferred))
+        while len(self._samples) > 2 and now - self._samples[0][0] > THROUGHPUT_WINDOW:
+            self._samples.popleft()
+
+        start_time, start_bytes = self._samples[0]
+        elapsed = now - start_time
+        return (self._bytes_transferred - start_bytes) / elapsed if elapsed > 0 else 0.0
+
+    def _refresh(self):
+        total_bytes = self._total_bytes or 1
+        self._progress_bar.setValue(int(PROGRESS_STEPS * min(self._bytes_done, total_bytes) / total_bytes))
+        if self._last_downloaded is not None:
+            self._label.setText(f"Downloaded: {self._last_downloaded} ({len(self._finished)} of {self.total_files})")
+
+        throughput = self._throughput()
+        rate_text = f"{_format_bytes(self._bytes_done)} of {_format_bytes(self._total_bytes)}"
+        if throughput > 0:
+            remaining = max(0, self._total_bytes - self._bytes_done) / throughput
+            rate_text += f", {_format_bytes(throughput)}/s, about {_format_duration(remaining)} remaining"
+        self._rate_label.setText(rate_text)
+
+    def done(self, result):
+        # A closed dialog is only hidden, it must not keep redrawing.
+        self._refresh_timer.stop()
+        super().done(result)
 
     @Slot(str, float)
-    def on_file_progress(self, file_path, progress):
-        self._register_file_path(file_path)
-        self._individual_progress[self._seen_file[file_path]] = progress
-        self._update_progress_bar()
+    def on_file_progress(self, file_path, bytes_received):
+        weight = self._weights.get(file_path)
+        if weight is None or file_path in self._finished:
+            return
+
+        received = min(int(bytes_received), weight)
+        if file_path not in self._received:
+            # A resumed download counts from its partial file, only bytes after the first report were transferred now.
+            self._count(file_path, received)
+            return
 
-    @Slot(str)
+        self._bytes_transferred += max(0, self._count(file_path, received))
+
+    @Slot(str, str)
     def on_file_downloaded(self, file_path, item_data_str):
         item_data = json.loads(item_data_str)
-        self._register_file_path(file_path)
-        self._individual_progress[self._seen_file[file_path]] = 1
-        self._update_progress_bar()
-
-        self._label.setText(f"Downloaded: {item_data.get('name', os.path.basename(file_path))}")
         if file_path == "error":
             self._errors += 1
+            key = self._destination_of(item_data)
+        else:
+            key = file_path
+
+        if key not in self._finished:
+            self._finished.add(key)
+            self._count(key, self._weights.get(key, 0))
+
+        self._last_downloaded = item_data.get('name', os.path.basename(file_path))
 
-        if sum(self._individual_progress) >= self.total_files:
+        if len(self._finished) >= self.total_files:
+            self._refresh_timer.stop()
+            self._refresh()
             label_text = "All downloads complete."
             dialog_close_delay = 500
             if self._errors > 0:
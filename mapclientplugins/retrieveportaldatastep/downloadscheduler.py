@@ -0,0 +1,125 @@
+"""
+Bounded, prioritised scheduler for download tasks.
+
+The scheduler owns its own thread pool so that cancelling a batch of downloads
+never touches tasks belonging to MAP Client or other plugins.  Tasks are only
+created when a worker is free to run them, which keeps the number of live
+task objects bounded however many files are queued.
+"""
+import heapq
+import itertools
+import threading
+
+from PySide6 import QtCore
+
+from mapclientplugins.retrieveportaldatastep.stepsettings import DEFAULT_MAX_CONCURRENT_DOWNLOADS, \
+    DEFAULT_MAX_DOWNLOADS_PER_HOST
+
+
+class DownloadBatch(object):
+
+    def __init__(self):
+        self.cancel_event = threading.Event()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+
+class _ScheduledTask(QtCore.QRunnable):
+
+    def __init__(self, task, release):
+        super().__init__()
+        self._task = task
+        self._release = release
+
+    def run(self):
+        try:
+            self._task.run()
+        finally:
+            self._release()
+
+
+class DownloadScheduler(QtCore.QObject):
+    _slot_released = QtCore.Signal(str)
+
+    def __init__(self, max_concurrent=DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+                 max_per_host=DEFAULT_MAX_DOWNLOADS_PER_HOST, parent=None):
+        super().__init__(parent)
+        self._max_concurrent = max(1, max_concurrent)
+        self._max_per_host = max(1, min(max_per_host, self._max_concurrent))
+        self._thread_pool = QtCore.QThreadPool(self)
+        self._thread_pool.setMaxThreadCount(self._max_concurrent)
+        # Queued entries are kept in a priority queue per host.
+        self._queues = {}
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._in_flight_per_host = {}
+        self._slot_released.connect(self._release)
+
+    def max_concurrent(self):
+        return self._max_concurrent
+
+    def create_batch(self):
+        return DownloadBatch()
+
+    def submit(self, batch, items, create_task, host_of, priority):
+        """
+        Queue items for download.
+
+        :param batch: The batch the items belong to, used for cancellation.
+        :param items: The items to download.
+        :param create_task: Callable creating the runnable for an item when it is about to start.
+        :param host_of: Callable returning the host an item is downloaded from.
+        :param priority: Callable returning the priority of an item, lower values start first.
+        """
+        for item in items:
+            host = host_of(item)
+            queue = self._queues.setdefault(host, [])
+            heapq.heappush(queue, (priority(item), next(self._sequence), batch, item, create_task))
+
+        self._fill()
+
+    def cancel(self, batch):
+        """
+        Cancel the running tasks of the given batch and drop the ones not yet started.
+        """
+        batch.cancel_event.set()
+        for host, queue in self._queues.items():
+            queue = [entry for entry in queue if entry[2] is not batch]
+            heapq.heapify(queue)
+            self._queues[host] = queue
+
+    def _host_available(self, host):
+        return self._in_flight_per_host.get(host, 0) < self._max_per_host
+
+    def _next_entry(self):
+        best_host = None
+        for host, queue in self._queues.items():
+            if queue and self._host_available(host):
+                if best_host is None or queue[0][:2] < self._queues[best_host][0][:2]:
+                    best_host = host
+
+        if best_host is None:
+            return None, None
+
+        return best_host, heapq.heappop(self._queues[best_host])
+
+    def _fill(self):
+        while self._in_flight < self._max_concurrent:
+            host, entry = self._next_entry()
+            if entry is None:
+                break
+
+            _, _, batch, item, create_task = entry
+            if batch.is_cancelled():
+                continue
+
+            self._in_flight += 1
+            self._in_flight_per_host[host] = self._in_flight_per_host.get(host, 0) + 1
+            task = create_task(item)
+            self._thread_pool.start(_ScheduledTask(task, lambda h=host: self._slot_released.emit(h)))
+
+    def _release(self, host):
+        self._in_flight -= 1
+        self._in_flight_per_host[host] -= 1
+        self._fill()
@@ -0,0 +1,840 @@
+"""
+Search and download engine, free of any GUI.
+
+The step widget and the command line entry point share these functions: the
+searches yield pages of results as they are received, the downloaders report
+progress and completion through plain callables, and download_items runs a
+batch on a thread pool recording the completed files in the step's manifest.
+"""
+import concurrent.futures
+import json
+import os
+import pathlib
+import tempfile
+import threading
+import time
+
+from requests import HTTPError
+from urllib.parse import urlparse
+
+from mapclientplugins.retrieveportaldatastep import transport
+from mapclientplugins.retrieveportaldatastep.definitions import DEFAULT_VALUE, DEFAULT_HEADERS
+from mapclientplugins.retrieveportaldatastep.scicrunch_requests import create_filter_request, \
+    form_scicrunch_match_request, iterate_result_pages, facets_query, doi_query, dataset_id_query, \
+    object_match_query, objects_after_query, form_nested_object_request, form_dataset_objects_request, \
+    inner_object_hits, result_window_exceeded, DATASET_SOURCE_FIELDS, OBJECT_SOURCE_FIELDS
+from mapclientplugins.retrieveportaldatastep.manifest import ManifestStore, load_settings, write_settings
+from mapclientplugins.retrieveportaldatastep.searchcache import SearchCache, request_key
+from mapclientplugins.retrieveportaldatastep.zipstream import extract_zip_stream
+from mapclientplugins.retrieveportaldatastep.jsonstream import StreamedArray, decode
+from mapclientplugins.retrieveportaldatastep.objectstore import ObjectStore, OBJECT_STORE_DIRNAME
+from mapclientplugins.retrieveportaldatastep.filemetadata import FileMetadataResolver, dataset_file_path, \
+    dataset_files_endpoint
+from mapclientplugins.retrieveportaldatastep.hashcache import HashCache, compute_sha256, hash_cache_filename, \
+    MISSING_FILE_DIGEST
+
+POSSIBLE_DOI_SUFFIXES = ["DOI:", "https://doi.org/", "http://dx.doi.org/"]
+API_KEY_NAME = "SCICRUNCH_API_KEY"
+SEARCH_PAGE_SIZE = 100
+# Hits are passed on in batches of this size while a page of results is being received.
+SEARCH_STREAM_BATCH_SIZE = 10
+SEARCH_STREAM_CHUNK_SIZE = 64 * 1024
+SEARCH_HITS_PATH = ("hits", "hits")
+SEARCH_CACHE_DIRNAME = "retrieveportaldata-search-cache"
+SCICRUNCH_SEARCH_URL = "https://scicrunch.org/api/1/elastic/SPARC_PortalDatasets_pr/_search"
+PENNSIEVE_SEARCH_FILES_URL = "https://api.pennsieve.io/discover/search/files"
+PENNSIEVE_ZIPIT_URL = "https://api.pennsieve.io/zipit/discover"
+
+_search_cache = None
+PARTIAL_SUFFIX = ".part"
+# Files up to this size are fetched in groups with a single archive request.
+SMALL_FILE_SIZE = 4 * 1024 * 1024
+MAX_GROUP_FILES = 100
+MAX_GROUP_BYTES = 32 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Seconds between progress reports from a download.
+PROGRESS_INTERVAL = 1 / 15
+DEFAULT_MAX_DOWNLOADS = 8
+
+
+def set_search_cache_directory(cache_dir):
+    """
+    Keep the search cache in cache_dir, the temporary directory is used until this is called.
+    """
+    global _search_cache
+    _search_cache = SearchCache(cache_dir)
+
+
+def _get_search_cache():
+    global _search_cache
+    if _search_cache is None:
+        _search_cache = SearchCache(os.path.join(tempfile.gettempdir(), SEARCH_CACHE_DIRNAME))
+
+    return _search_cache
+
+
+def _ignore(*args):
+    pass
+
+
+def _do_scicrunch_request(req, stream=False):
+    base_url = SCICRUNCH_SEARCH_URL
+    params = {
+        "api_key": os.environ.get(API_KEY_NAME, DEFAULT_VALUE),
+    }
+    headers = DEFAULT_HEADERS
+    return transport.post(base_url, json=req, params=params, headers=headers, stream=stream)
+
+
+def _response_chunks(response):
+    with response:
+        yield from response.iter_content(SEARCH_STREAM_CHUNK_SIZE)
+
+
+def standardise_doi_form(text):
+    for suffix in POSSIBLE_DOI_SUFFIXES:
+        if text.startswith(suffix):
+            text = text.replace(suffix, "")
+            text = text.strip()
+
+    return text
+
+
+def _hit_dataset(result):
+    source = result["_source"]
+    return source["object_id"], source["pennsieve"]["version"]["identifier"]
+
+
+def _create_search_result(obj, dataset_id, dataset_version):
+    additional_mimetype = obj.get("additional_mimetype", {}).get("name")
+    return {
+        "name": obj["name"],
+        "datasetId": dataset_id,
+        "datasetVersion": dataset_version,
+        "mimetype": additional_mimetype if additional_mimetype else obj["mimetype"]["name"],
+        "datasetPath": obj["dataset"]["path"],
+        "size": obj.get("bytes", {}).get("count"),
+        "uri": "",
+    }
+
+
+def _form_scicrunch_search_request(search_text, search_type, facets):
+    target_field_parts = []
+    form_request = None
+    dataset_query = None
+    object_query = None
+    if search_type == "mimetype":
+        target_field_location = "objects.additional_mimetype.name"
+        target_field_parts = target_field_location.split(".")[1:]
+        dataset_query = facets_query(facets)
+        object_query = object_match_query(target_field_location, search_text)
+
+        def form_request(size, start, search_after):
+            return create_filter_request(search_text, facets, size, start, fields=[target_field_location],
+                                         search_after=search_after,
+                                         source_fields=DATASET_SOURCE_FIELDS + OBJECT_SOURCE_FIELDS)
+    elif search_type == "DOI":
+        source_fields = [
+            "object_id",
+            "pennsieve.version.identifier",
+            "item.curie",
+            "item.name",
+            "objects.name",
+            "objects.mimetype.name",
+            "objects.additional_mimetype.name",
+            "objects.dataset.path",
+            "objects.bytes.count",
+        ]
+        dataset_query = doi_query("item.curie", search_text)
+        object_query = object_match_query()
+
+        def form_request(size, start, search_after):
+            return form_scicrunch_match_request("item.curie", search_text, source_fields, size=size, start=start,
+                                                search_after=search_after)
+    else:
+        print("Something has gone wrong!", search_type, "is not a handled search type.")
+
+    return form_request, dataset_query, object_query, target_field_parts
+
+
+def _object_matches(obj, search_text, search_type, target_field_parts):
+    if obj["mimetype"]["name"] == "inode/directory":
+        return False
+
+    if search_type == "mimetype":
+        target_field_value = obj
+        for field in target_field_parts:
+            target_field_value = target_field_value.get(field, {})
+        return target_field_value == search_text
+
+    return search_type == "DOI"
+
+
+def _extract_search_results(result, objects, search_text, search_type, target_field_parts):
+    dataset_id, dataset_version = _hit_dataset(result)
+    return [_create_search_result(obj, dataset_id, dataset_version) for obj in objects
+            if _object_matches(obj, search_text, search_type, target_field_parts)]
+
+
+def _remaining_objects(result, objects, total, object_query, do_request):
+    """
+    Retrieve the matching objects of a dataset that did not fit in the first page of inner hits.
+    Each page continues after the path of the last object received, keeping every request
+    inside the inner hits window of the index.
+    """
+    dataset_id = result["_source"]["object_id"]
+    remaining = []
+    received = len(objects)
+    while objects and received < total:
+        last_path = (remaining or objects)[-1]["dataset"]["path"]
+        req = form_nested_object_request(dataset_id_query(dataset_id), objects_after_query(object_query, last_path),
+                                         1, 0)
+        try:
+            hits = decode(do_request(req)).get("hits", {}).get("hits", [])
+        except HTTPError as e:
+            if e.response is None or not result_window_exceeded(e.response.text):
+                raise
+
+            # The index allows fewer inner hits than a page, take the objects from the dataset itself.
+            hits = decode(do_request(form_dataset_objects_request(dataset_id))).get("hits", {}).get("hits", [])
+            received_paths = {obj["dataset"]["path"] for obj in objects + remaining}
+            dataset_objects = hits[0]["_source"].get("objects", []) if hits else []
+            remaining.extend(obj for obj in dataset_objects if obj["dataset"]["path"] not in received_paths)
+            break
+
+        page_objects = inner_object_hits(hits[0])[0] if hits else []
+        if not page_objects:
+            break
+        remaining.extend(page_objects)
+        received += len(page_objects)
+
+    return remaining
+
+
+def _scicrunch_nested_search_pages(search_text, search_type, dataset_query, object_query, target_field_parts,
+                                   do_request):
+    def form_request(size, start, search_after):
+        return form_nested_object_request(dataset_query, object_query, size, start, search_after)
+
+    for page in iterate_result_pages(form_request, do_request, SEARCH_PAGE_SIZE, SEARCH_STREAM_BATCH_SIZE):
+        search_result = []
+        for result in page:
+            objects, total = inner_object_hits(result)
+            objects.extend(_remaining_objects(result, objects, total, object_query, do_request))
+            search_result.extend(_extract_search_results(result, objects, search_text, search_type,
+                                                         target_field_parts))
+
+        yield search_result
+
+
+def scicrunch_search_pages(search_text, search_type, facets=None, offline=False):
+    """
+    Generator yielding the search results for batches of SciCrunch hits as they are received.
+    File objects are filtered by Elasticsearch where the index allows it, otherwise the
+    objects of each dataset are filtered here.
+    """
+    form_request, dataset_query, object_query, target_field_parts = _form_scicrunch_search_request(
+        search_text, search_type, facets)
+    if form_request is None:
+        return
+
+    search_cache = _get_search_cache()
+
+    def do_request(req):
+        key = request_key(SCICRUNCH_SEARCH_URL, body=req)
+
+        def fetch():
+            response = _do_scicrunch_request(req, stream=True)
+            response.raise_for_status()
+            # The hits are decoded as they arrive, the complete response is cached once it has been read.
+            return StreamedArray(_response_chunks(response), SEARCH_HITS_PATH, keep_items=True,
+                                 on_complete=lambda document: search_cache.put(key, document))
+
+        return search_cache.fetch(key, fetch, offline, store=False)
+
+    nested_pages = _scicrunch_nested_search_pages(search_text, search_type, dataset_query, object_query,
+                                                  target_field_parts, do_request)
+    try:
+        first_page = next(nested_pages, None)
+    except HTTPError:
+        # The objects are not indexed as nested documents.
+        first_page = None
+        nested_pages = None
+
+    if nested_pages is not None:
+        if first_page is not None:
+            yield first_page
+            yield from nested_pages
+        return
+
+    for page in iterate_result_pages(form_request, do_request, SEARCH_PAGE_SIZE, SEARCH_STREAM_BATCH_SIZE):
+        search_result = []
+        for result in page:
+            search_result.extend(_extract_search_results(result, result["_source"].get("objects", []),
+                                                         search_text, search_type, target_field_parts))
+
+        yield search_result
+
+
+def pennsieve_file_search_pages(search_text, dataset_id, offline=False):
+    """
+    Generator yielding the files matching a filename search for each page of results from Pennsieve.
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "application/json; charset=utf-8",
+    }
+    offset = 0
+    while True:
+        params = {
+            "limit": SEARCH_PAGE_SIZE,
+            "offset": offset,
+            "query": search_text,
+            "datasetId": dataset_id,
+        }
+
+        def fetch():
+            response = transport.get(PENNSIEVE_SEARCH_FILES_URL, headers=headers, params=params)
+            return response.json() if response.status_code == 200 else None
+
+        json_data = _get_search_cache().fetch(request_key(PENNSIEVE_SEARCH_FILES_URL, params=params), fetch, offline)
+        if json_data is None:
+            return
+
+        files = json_data.get('files', [])
+        if not files:
+            return
+
+        yield files
+
+        offset += len(files)
+        if len(files) < SEARCH_PAGE_SIZE or offset >= json_data.get('totalCount', 0):
+            return
+
+
+def get_sha256(file_path):
+    if not os.path.isfile(file_path):
+        return MISSING_FILE_DIGEST
+
+    return compute_sha256(file_path)
+
+
+def _form_pennsieve_download_file_endpoint(item):
+    return dataset_files_endpoint(item)
+
+
+def download_host(item):
+    return urlparse(_form_pennsieve_download_file_endpoint(item)).netloc
+
+
+def determine_dataset_path(uri):
+    if uri:
+        parsed_object = urlparse(uri)
+        return parsed_object.path.split("files/")[1]
+
+    return ''
+
+
+def search_result_item(file_info):
+    """
+    Return a search result, from SciCrunch or Pennsieve, in the form used by the downloaders.
+    """
+    dataset_path = file_info.get('datasetPath')
+    if dataset_path is None:
+        dataset_path = determine_dataset_path(file_info.get('uri'))
+
+    return {
+        'name': file_info['name'],
+        'datasetId': file_info['datasetId'],
+        'datasetVersion': file_info['datasetVersion'],
+        'mimetype': file_info.get('mimetype', file_info.get('fileType', '')),
+        'datasetPath': dataset_path,
+        'size': file_info.get('size'),
+    }
+
+
+def _item_size(item):
+    size = item.get('size')
+    return size if isinstance(size, (int, float)) else None
+
+
+def group_download_items(items):
+    """
+    Split items into units of work.  Small files from the same dataset version are grouped
+    so that they can be fetched with one archive request, everything else is a unit of its own.
+    """
+    units = []
+    groups = {}
+    for item in items:
+        size = _item_size(item)
+        if size is None or size > SMALL_FILE_SIZE:
+            units.append([item])
+            continue
+
+        key = (str(item['datasetId']), str(item['datasetVersion']))
+        group, group_bytes = groups.get(key, (None, 0))
+        if group is None or len(group) >= MAX_GROUP_FILES or group_bytes + size > MAX_GROUP_BYTES:
+            group, group_bytes = [], 0
+            units.append(group)
+        group.append(item)
+        groups[key] = (group, group_bytes + size)
+
+    return units
+
+
+def download_unit_priority(unit):
+    sizes = [_item_size(item) for item in unit]
+    return float('inf') if None in sizes else sum(sizes)
+
+
+def safe_makedirs(path):
+    try:
+        os.makedirs(path, exist_ok=True)
+    except FileExistsError:
+        # Another thread might have created it between the check and the call
+        pass
+
+
+def downloaded_item(item, json_data):
+    """
+    Return item as recorded in the manifest, with the checksum and size of the file it was downloaded as.
+    """
+    recorded = dict(item)
+    for key in ('sha256', 'size'):
+        if json_data.get(key) is not None:
+            recorded[key] = json_data[key]
+
+    return recorded
+
+
+def zipit_request(item, paths):
+    """
+    Body of a request for the files at paths of the dataset version of item.
+    """
+    return {
+        "data": {
+            "paths": paths,
+            "datasetId": item['datasetId'],
+            "version": item['datasetVersion'],
+        }
+    }
+
+
+def transfer_headers(resume_from=0):
+    """
+    Headers of a zipit request, asking for the content after resume_from when a partial file is resumed.
+    """
+    headers = {"content-type": "application/json"}
+    if resume_from:
+        headers["Range"] = f"bytes={resume_from}-"
+
+    return headers
+
+
+def transfer_start(status_code, resume_from):
+    """
+    Return the offset the content of a transfer response starts at and the mode to open the partial file with.
+    """
+    if status_code != 206:
+        # The server did not honour the range request, fetch the whole file again.
+        return 0, 'wb'
+
+    return resume_from, 'ab'
+
+
+class TransferProgress(object):
+    """
+    Bytes received for a file, reported at a bounded rate so that many downloads do not flood the GUI thread.
+    """
+
+    def __init__(self, progress, local_destination, bytes_received):
+        self._progress = progress
+        self._local_destination = local_destination
+        self._last_reported = 0.0
+        self.bytes_received = bytes_received
+
+    def add(self, size):
+        self.bytes_received += size
+        now = time.monotonic()
+        if now - self._last_reported >= PROGRESS_INTERVAL:
+            self._progress(self._local_destination, self.bytes_received)
+            self._last_reported = now
+
+
+def partial_filename(local_destination):
+    return f"{local_destination}{PARTIAL_SUFFIX}"
+
+
+def _resume_metadata_filename(local_destination):
+    return f"{local_destination}{PARTIAL_SUFFIX}.json"
+
+
+def _save_resume_metadata(local_destination, sha256, size):
+    with open(_resume_metadata_filename(local_destination), 'w') as f:
+        json.dump({'sha256': sha256, 'size': size}, f)
+
+
+def _remove_resume_metadata(local_destination):
+    try:
+        os.remove(_resume_metadata_filename(local_destination))
+    except OSError:
+        pass
+
+
+def _resume_offset(local_destination, sha256, size):
+    """
+    Determine how many bytes of a previous partial download can be kept.
+    A partial file is only resumed if it was started for the same version of the file.
+    """
+    partial_destination = partial_filename(local_destination)
+    if not os.path.isfile(partial_destination):
+        return 0
+
+    try:
+        with open(_resume_metadata_filename(local_destination)) as f:
+            metadata = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        metadata = {}
+
+    partial_size = os.path.getsize(partial_destination)
+    if metadata.get('sha256') == sha256 and metadata.get('size') == size and partial_size <= size:
+        if partial_size < size or get_sha256(partial_destination) == sha256:
+            return partial_size
+
+    os.remove(partial_destination)
+    return 0
+
+
+class FileDownloader(object):
+    """
+    Download a single file, skipping the transfer if the file is already present locally
+    or in the object store, and resuming a previous partial download where possible.
+    Progress is reported as (local destination, bytes received), completion as
+    (local destination, item as JSON) with "error" as the destination on failure.
+    """
+
+    def __init__(self, item, output_dir, cancel_event: threading.Event, hash_cache=None, metadata_resolver=None,
+                 object_store=None, progress=None, finished=None):
+        self._item = item
+        self._output_dir = output_dir
+        self._cancel_event = cancel_event
+        self._hash_cache = hash_cache
+        self._metadata_resolver = metadata_resolver
+        self._object_store = object_store
+        self._progress = progress or _ignore
+        self._finished = finished or _ignore
+
+    def _file_metadata(self):
+        if self._metadata_resolver is None:
+            uri = _form_pennsieve_download_file_endpoint(self._item)
+            response = transport.get(uri, params={'path': dataset_file_path(self._item)})
+            return response.json()
+
+        return self._metadata_resolver.resolve(self._item)
+
+    def _materialise(self, sha256, local_destination):
+        # Content we already hold under another path does not need to be transferred again.
+        if self._object_store is None or not sha256:
+            return False
+
+        return self._object_store.materialise(sha256, local_destination)
+
+    def _local_sha256(self, local_destination):
+        if self._hash_cache is None:
+            return get_sha256(local_destination)
+
+        return self._hash_cache.get_sha256(local_destination)
+
+    def run(self):
+        # If cancellation was already requested before this task started, exit early
+        if self._cancel_event.is_set():
+            return
+
+        local_destination = "error"
+        was_cancelled = False
+        finished_item = self._item
+
+        try:
+            local_destination, json_data, transfer_required = self.prepare()
+            if transfer_required:
+                file_size = json_data.get('size', 0)
+                resume_from = self.start_transfer(local_destination, json_data)
+
+                if not (file_size and resume_from == file_size):
+                    was_cancelled = self._download(dataset_file_path(self._item), local_destination, file_size, resume_from)
+
+                if not was_cancelled and not self.complete_transfer(local_destination, json_data):
+                    local_destination = "error"
+            finished_item = downloaded_item(self._item, json_data)
+
+        except Exception as e:
+            print("Handling unknown exception in FileDownloader:")
+            print(e)
+
+        finally:
+            # A cancelled download leaves its partial file in place so that it can be resumed later.
+            if not was_cancelled:
+                # Only emit finished signal if the download wasn't cancelled.
+                self._finished(local_destination, json.dumps(finished_item))
+
+    def prepare(self):
+        """
+        Determine the local destination and the file metadata for the item, and whether
+        the file still has to be transferred.
+        """
+        local_destination = form_local_destination(self._output_dir, self._item)
+        local_dir = os.path.dirname(local_destination)
+        safe_makedirs(local_dir)
+
+        json_data = self._file_metadata()
+        expected_sha256 = json_data.get('sha256', '')
+        if expected_sha256 == self._local_sha256(local_destination):
+            if self._object_store is not None:
+                self._object_store.adopt(local_destination, expected_sha256)
+            return local_destination, json_data, False
+
+        return local_destination, json_data, not self._materialise(expected_sha256, local_destination)
+
+    def start_transfer(self, local_destination, json_data):
+        """
+        Return the offset the transfer resumes from, recording what the partial file is being downloaded for.
+        """
+        expected_sha256 = json_data.get('sha256', '')
+        file_size = json_data.get('size', 0)
+        resume_from = _resume_offset(local_destination, expected_sha256, file_size)
+        _save_resume_metadata(local_destination, expected_sha256, file_size)
+        return resume_from
+
+    def complete_transfer(self, local_destination, json_data):
+        """
+        Install the partial file at local_destination, returns False if the transfer ended early
+        or its content does not match the expected sha256.  A partial file that is shorter than
+        expected is kept so that the download can be resumed, corrupt content is discarded.
+        """
+        partial_destination = partial_filename(local_destination)
+        file_size = json_data.get('size')
+        if file_size and os.path.getsize(partial_destination) != file_size:
+            print(f"Download of {local_destination} ended early, keeping the partial file to resume later.")
+            return False
+
+        installed = self._finalise(partial_destination, local_destination, json_data.get('sha256', ''))
+        _remove_resume_metadata(local_destination)
+        return installed
+
+    def _finalise(self, partial_destination, local_destination, sha256):
+        # Without an object store or an expected digest there is nothing to check the content against.
+        if self._object_store is None or self._object_store.object_path(sha256) is None:
+            os.replace(partial_destination, local_destination)
+            return True
+
+        if not self._object_store.store(partial_destination, sha256):
+            print(f"Download of {local_destination} does not match its checksum, discarding it.")
+            os.remove(partial_destination)
+            return False
+
+        self._object_store.materialise(sha256, local_destination)
+        return True
+
+    def _download(self, path, local_destination, file_size, resume_from):
+        req = zipit_request(self._item, [path])
+
+        # Use requests with a timeout so threads don't hang indefinitely on bad connections.
+        with transport.post(
+            PENNSIEVE_ZIPIT_URL, json=req, headers=transfer_headers(resume_from), stream=True, timeout=10
+        ) as response:
+            response.raise_for_status()
+
+            resume_from, mode = transfer_start(response.status_code, resume_from)
+            transfer_progress = TransferProgress(self._progress, local_destination, resume_from)
+            # Write chunks to disk and check cancellation flag periodically.
+            with open(partial_filename(local_destination), mode) as f:
+                for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    if self._cancel_event.is_set():
+                        return True
+                    if chunk:
+                        f.write(chunk)
+                        transfer_progress.add(len(chunk))
+
+        return False
+
+
+class ZipBatchDownloader(object):
+    """
+    Download a group of small files from the same dataset version with a single zipit request,
+    extracting the archive as it is received.  Any file that does not arrive intact is
+    downloaded on its own afterwards.
+    """
+
+    def __init__(self, items, output_dir, cancel_event: threading.Event, hash_cache=None, metadata_resolver=None,
+                 object_store=None, progress=None, finished=None):
+        self._items = items
+        self._cancel_event = cancel_event
+        self._finished = finished or _ignore
+        self._member_tasks = [
+            FileDownloader(item, output_dir, cancel_event, hash_cache, metadata_resolver, object_store, progress,
+                           finished)
+            for item in items
+        ]
+
+    def run(self):
+        if self._cancel_event.is_set():
+            return
+
+        pending = {}
+        for task in self._member_tasks:
+            try:
+                local_destination, json_data, transfer_required = task.prepare()
+            except Exception as e:
+                print("Handling unknown exception in ZipBatchDownloader:")
+                print(e)
+                local_destination, json_data, transfer_required = "error", {}, False
+
+            if transfer_required:
+                pending[dataset_file_path(task._item)] = (task, local_destination, json_data)
+            else:
+                self._finished(local_destination, json.dumps(downloaded_item(task._item, json_data)))
+
+        if len(pending) > 1:
+            try:
+                self._download_archive(pending)
+            except Exception as e:
+                print("Handling unknown exception in ZipBatchDownloader:")
+                print(e)
+
+        # Whatever did not arrive intact in the archive is fetched individually.
+        for task, _, _ in list(pending.values()):
+            if self._cancel_event.is_set():
+                return
+            task.run()
+
+    def _match_member(self, name, pending):
+        for candidate in (name, f'files/{name}'):
+            if candidate in pending:
+                return candidate
+
+        matches = [path for path in pending if path.endswith(f'/{name}')]
+        return matches[0] if len(matches) == 1 else None
+
+    def _download_archive(self, pending):
+        first_item = self._member_tasks[0]._item
+        req = zipit_request(first_item, list(pending.keys()))
+        open_members = {}
+
+        def open_member(name):
+            path = self._match_member(name, pending)
+            if path is None:
+                return None
+            _, local_destination, _ = pending[path]
+            open_members[name] = (path, open(partial_filename(local_destination), 'wb'))
+            return open_members[name][1]
+
+        def chunks():
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                if self._cancel_event.is_set():
+                    return
+                yield chunk
+
+        try:
+            with transport.post(PENNSIEVE_ZIPIT_URL, json=req, headers=transfer_headers(), stream=True,
+                                timeout=10) as response:
+                response.raise_for_status()
+                for name, crc_valid in extract_zip_stream(chunks(), open_member):
+                    path, f = open_members.pop(name)
+                    f.close()
+                    task, local_destination, json_data = pending[path]
+                    # A member that is not intact is left pending and fetched on its own.
+                    if crc_valid and task.complete_transfer(local_destination, json_data):
+                        del pending[path]
+                        self._finished(local_destination, json.dumps(downloaded_item(task._item, json_data)))
+        finally:
+            for _, f in open_members.values():
+                f.close()
+
+
+def form_local_destination(base_dir, info):
+    near_relative_local_path = info['datasetPath'].replace('files/', '')
+    return os.path.join(base_dir, str(info['datasetId']), str(info['datasetVersion']), near_relative_local_path)
+
+
+def manifest_key(output_dir, item_data):
+    local_dest = form_local_destination(output_dir, item_data)
+    rel_path = os.path.relpath(local_dest, output_dir)
+    return pathlib.PureWindowsPath(rel_path).as_posix()
+
+
+def _output_files(output_dir, settings_filename, local_destinations):
+    settings = load_settings(settings_filename)
+    output_files = settings.get('output-files', [])
+    known = set(output_files)
+    for local_destination in local_destinations:
+        rel_path = pathlib.PureWindowsPath(os.path.relpath(local_destination, output_dir)).as_posix()
+        if rel_path not in known:
+            known.add(rel_path)
+            output_files.append(rel_path)
+
+    settings['output-files'] = output_files
+    write_settings(settings_filename, settings)
+
+
+def download_items(items, output_dir, settings_filename, max_downloads=DEFAULT_MAX_DOWNLOADS, cancel_event=None,
+                   progress=None, finished=None):
+    """
+    Download items into output_dir, laid out and recorded in the manifest of settings_filename
+    as the step does, and add the downloaded files to the files the step provides.
+    Downloads interrupted by an earlier run are resumed.  Returns the number of failed downloads.
+    """
+    cancel_event = threading.Event() if cancel_event is None else cancel_event
+    progress = progress or _ignore
+    finished = finished or _ignore
+    manifest = ManifestStore(settings_filename)
+    hash_cache = HashCache(hash_cache_filename(settings_filename))
+    metadata_resolver = FileMetadataResolver()
+    object_store = ObjectStore(os.path.join(output_dir, OBJECT_STORE_DIRNAME), hash_cache)
+
+    pending_downloads = dict(manifest.pending_downloads())
+    items = list(pending_downloads.values()) + [item for item in items
+                                                if manifest_key(output_dir, item) not in pending_downloads]
+    for item in items:
+        pending_downloads[manifest_key(output_dir, item)] = item
+    manifest.set_pending_downloads(dict(pending_downloads))
+
+    lock = threading.Lock()
+    downloaded = []
+    failures = []
+
+    def on_finished(local_destination, item_data_str):
+        item_data = json.loads(item_data_str)
+        with lock:
+            if local_destination != "error" and os.path.exists(local_destination):
+                path_key = manifest_key(output_dir, item_data)
+                manifest.add(path_key, item_data)
+                pending_downloads.pop(path_key, None)
+                downloaded.append(local_destination)
+            else:
+                failures.append(item_data)
+        finished(local_destination, item_data_str)
+
+    def create_downloader(unit):
+        if len(unit) == 1:
+            return FileDownloader(unit[0], output_dir, cancel_event, hash_cache, metadata_resolver, object_store,
+                                  progress, on_finished)
+
+        return ZipBatchDownloader(unit, output_dir, cancel_event, hash_cache, metadata_resolver, object_store,
+                                  progress, on_finished)
+
+    metadata_resolver.prefetch(items)
+    units = sorted(group_download_items(items), key=download_unit_priority)
+    transport.set_pool_size(max_downloads)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_downloads)) as executor:
+        for unit in units:
+            executor.submit(create_downloader(unit).run)
+
+    hash_cache.save()
+    # Only downloads that left a partial file behind are worth resuming.
+    manifest.set_pending_downloads({
+        rel_path: item_data for rel_path, item_data in pending_downloads.items()
+        if os.path.isfile(partial_filename(os.path.join(output_dir, rel_path)))
+    })
+    _output_files(output_dir, settings_filename, downloaded)
+
+    return len(failures)
@@ -0,0 +1,315 @@
+"""
+Tree model of the downloaded files, rooted at the output directory.
+
+A directory is only listed when the view first expands it, and its entries
+are handed to the view in batches as it asks for more, so an output
+directory holding thousands of dataset folders opens straight away.  The
+entries come either from the filesystem, one os.scandir per directory, or
+from the download manifest without touching the filesystem at all.  Files
+landing while downloads run are queued and added to the tree together.
+"""
+import bisect
+import os
+import posixpath
+
+from PySide6 import QtCore, QtWidgets
+
+COLUMN_HEADERS = ['Name', 'Size', 'Type', 'Date Modified']
+FETCH_BATCH_SIZE = 1000
+# Milliseconds files are collected for before they are added to the tree.
+UPDATE_INTERVAL = 250
+
+
+def _sort_key(is_dir, name):
+    return not is_dir, name.lower(), name
+
+
+class _Node(object):
+    __slots__ = ('name', 'parent', 'is_dir', 'row', 'key', 'children', 'pending', 'lookup', 'size', 'kind',
+                 'modified', 'stat_done')
+
+    def __init__(self, name, parent, is_dir, size=None, kind=None):
+        self.name = name
+        self.parent = parent
+        self.is_dir = is_dir
+        self.row = 0
+        self.key = _sort_key(is_dir, name)
+        # Children are None until the directory is listed, pending holds those not yet fetched by the view.
+        self.children = None
+        self.pending = []
+        self.lookup = {}
+        self.size = size
+        self.kind = kind
+        self.modified = None
+        self.stat_done = False
+
+    def rel_path(self):
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+
+        return posixpath.join(*reversed(parts)) if parts else ''
+
+
+def _manifest_index(manifest_entries):
+    """
+    Map every directory of the manifest to the (name, is_dir, item) of its entries.
+    """
+    index = {}
+    for rel_path, item_data in manifest_entries.items():
+        _add_to_index(index, rel_path, item_data)
+
+    return index
+
+
+def _add_to_index(index, rel_path, item_data):
+    directory, name = posixpath.split(rel_path)
+    index.setdefault(directory, {})[name] = (False, item_data)
+    while directory:
+        parent, name = posixpath.split(directory)
+        entries = index.setdefault(parent, {})
+        if name in entries:
+            break
+        entries[name] = (True, None)
+        directory = parent
+
+
+class OutputDirectoryModel(QtCore.QAbstractItemModel):
+    """
+    :param root_dir: Output directory shown as the root of the tree.
+    :param manifest_entries: Download manifest, relative path to item, to list
+        entries from instead of the filesystem.
+    """
+
+    def __init__(self, root_dir, manifest_entries=None, parent=None, fetch_batch_size=FETCH_BATCH_SIZE):
+        super().__init__(parent)
+        self._root_dir = root_dir
+        self._fetch_batch_size = fetch_batch_size
+        self._manifest_index = None if manifest_entries is None else _manifest_index(manifest_entries)
+        self._root = _Node('', None, True)
+        self._inserting = False
+        self._added = {}
+        self._update_timer = QtCore.QTimer(self)
+        self._update_timer.setSingleShot(True)
+        self._update_timer.setInterval(UPDATE_INTERVAL)
+        self._update_timer.timeout.connect(self._apply_added)
+        style = QtWidgets.QApplication.style()
+        self._directory_icon = style.standardIcon(QtWidgets.QStyle.StandardPixmap.SP_DirIcon)
+        self._file_icon = style.standardIcon(QtWidgets.QStyle.StandardPixmap.SP_FileIcon)
+
+    def _node(self, index):
+        return index.internalPointer() if index.isValid() else self._root
+
+    def _list(self, node):
+        rel_path = node.rel_path()
+        if self._manifest_index is not None:
+            entries = self._manifest_index.get(rel_path, {})
+            return [_Node(name, node, is_dir, *self._item_details(item_data))
+                    for name, (is_dir, item_data) in entries.items()]
+
+        nodes = []
+        try:
+            with os.scandir(os.path.join(self._root_dir, rel_path)) as it:
+                for entry in it:
+                    # Hidden entries, such as the object store, are not shown.
+                    if not entry.name.startswith('.'):
+                        nodes.append(_Node(entry.name, node, entry.is_dir()))
+        except OSError:
+            pass
+
+        return nodes
+
+    def _item_details(self, item_data):
+        if item_data is None:
+            return None, None
+
+        return item_data.get('size'), item_data.get('mimetype')
+
+    def _stat(self, node):
+        # Size and modification time of filesystem entries are only looked up once they are displayed.
+        node.stat_done = True
+        if self._manifest_index is not None:
+            return
+
+        try:
+            stat_result = os.stat(os.path.join(self._root_dir, node.rel_path()))
+        except OSError:
+            return
+
+        if not node.is_dir:
+            node.size = stat_result.st_size
+        node.modified = QtCore.QDateTime.fromSecsSinceEpoch(int(stat_result.st_mtime))
+
+    def _populate(self, node):
+        nodes = sorted(self._list(node), key=lambda child: child.key)
+        node.children = []
+        node.pending = nodes
+        node.lookup = {child.name: child for child in nodes}
+
+    def add_file(self, file_path, item_data=None):
+        """
+        Queue a file that has landed in the output directory, files are added to the tree in batches.
+        """
+        rel_path = os.path.relpath(file_path, self._root_dir).replace(os.sep, '/')
+        self._added[rel_path] = item_data
+        if not self._update_timer.isActive():
+            self._update_timer.start()
+
+    def _apply_added(self):
+        added = self._added
+        self._added = {}
+        for rel_path, item_data in added.items():
+            if self._manifest_index is not None:
+                _add_to_index(self._manifest_index, rel_path, item_data)
+            self._add_path(rel_path.split('/'), item_data)
+
+    def _add_path(self, parts, item_data):
+        node = self._root
+        for position, name in enumerate(parts):
+            # Directories not listed yet pick the file up when they are.
+            if node.children is None:
+                return
+
+            child = node.lookup.get(name)
+            if child is None:
+                is_dir = position < len(parts) - 1
+                size, kind = self._item_details(None if is_dir else item_data)
+                child = _Node(name, node, is_dir, size, kind)
+                self._insert_child(node, child)
+                if not is_dir:
+                    return
+            elif not child.is_dir:
+                # A file downloaded again, its size and modification time are looked up afresh.
+                child.stat_done = False
+                if item_data is not None:
+                    child.size, child.kind = self._item_details(item_data)
+                if child.row < len(node.children) and node.children[child.row] is child:
+                    index = self.createIndex(child.row, 0, child)
+                    self.dataChanged.emit(index, index.siblingAtColumn(len(COLUMN_HEADERS) - 1))
+                return
+
+            node = child
+
+    def _insert_child(self, node, child):
+        node.lookup[child.name] = child
+        keys = [sibling.key for sibling in node.children]
+        row = bisect.bisect_left(keys, child.key)
+        if row == len(node.children) and node.pending and child.key > node.pending[0].key:
+            # Sorts among the entries the view has not fetched yet.
+            node.pending.insert(bisect.bisect_left([sibling.key for sibling in node.pending], child.key), child)
+            return
+
+        parent_index = QtCore.QModelIndex() if node is self._root else self.createIndex(node.row, 0, node)
+        self._inserting = True
+        try:
+            self.beginInsertRows(parent_index, row, row)
+            node.children.insert(row, child)
+            for position in range(row, len(node.children)):
+                node.children[position].row = position
+            self.endInsertRows()
+        finally:
+            self._inserting = False
+
+    def filePath(self, index):
+        return os.path.join(self._root_dir, self._node(index).rel_path())
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        node = self._node(parent)
+        if node.children is None or not 0 <= row < len(node.children) or not 0 <= column < len(COLUMN_HEADERS):
+            return QtCore.QModelIndex()
+
+        return self.createIndex(row, column, node.children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QtCore.QModelIndex()
+
+        parent_node = index.internalPointer().parent
+        if parent_node is None or parent_node is self._root:
+            return QtCore.QModelIndex()
+
+        return self.createIndex(parent_node.row, 0, parent_node)
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        node = self._node(parent)
+        if not node.is_dir:
+            return False
+
+        # Unlisted directories are assumed to have entries, the view shows them as expandable.
+        return node.children is None or bool(node.children) or bool(node.pending)
+
+    def canFetchMore(self, parent):
+        node = self._node(parent)
+        return not self._inserting and node.is_dir and (node.children is None or bool(node.pending))
+
+    def fetchMore(self, parent):
+        node = self._node(parent)
+        # Views may ask for more while rows are being inserted.
+        if self._inserting or not node.is_dir:
+            return
+
+        if node.children is None:
+            self._populate(node)
+
+        count = min(self._fetch_batch_size, len(node.pending))
+        if count <= 0:
+            return
+
+        first_row = len(node.children)
+        self._inserting = True
+        try:
+            self.beginInsertRows(parent, first_row, first_row + count - 1)
+            for position, child in enumerate(node.pending[:count]):
+                child.row = first_row + position
+            node.children.extend(node.pending[:count])
+            del node.pending[:count]
+            self.endInsertRows()
+        finally:
+            self._inserting = False
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.column() > 0:
+            return 0
+
+        node = self._node(parent)
+        return 0 if node.children is None else len(node.children)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(COLUMN_HEADERS)
+
+    def data(self, index, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        node = index.internalPointer()
+        column = index.column()
+        if role == QtCore.Qt.ItemDataRole.DecorationRole and column == 0:
+            return self._directory_icon if node.is_dir else self._file_icon
+        if role != QtCore.Qt.ItemDataRole.DisplayRole:
+            return None
+
+        if column == 0:
+            return node.name
+
+        if column == 2:
+            if node.is_dir:
+                return "Folder"
+            if node.kind:
+                return node.kind
+            suffix = posixpath.splitext(node.name)[1][1:]
+            return f"{suffix} File" if suffix else "File"
+
+        if not node.stat_done:
+            self._stat(node)
+        if column == 1:
+            return None if node.is_dir or node.size is None else QtCore.QLocale().formattedDataSize(node.size)
+
+        return node.modified
+
+    def headerData(self, section, orientation, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if orientation == QtCore.Qt.Orientation.Horizontal and role == QtCore.Qt.ItemDataRole.DisplayRole:
+            return COLUMN_HEADERS[section]
+
+        return super().headerData(section, orientation, role)
@@ -0,0 +1,144 @@
+"""
+Resolve the checksum and size of dataset files from batched directory listings.
+
+Instead of one metadata request per file, the files of a dataset version are
+listed a directory at a time (with paging) and the listing is cached for a
+while.  Download tasks then read the checksum and size from the cache.
+"""
+import posixpath
+import threading
+import time
+
+from mapclientplugins.retrieveportaldatastep import transport
+
+PENNSIEVE_DISCOVER_URL = "https://api.pennsieve.io/discover"
+DEFAULT_TTL = 300
+LISTING_PAGE_SIZE = 500
+
+
+def dataset_files_endpoint(item):
+    return f'{PENNSIEVE_DISCOVER_URL}/datasets/{item["datasetId"]}/versions/{item["datasetVersion"]}/files'
+
+
+def dataset_file_path(item):
+    dataset_path = item['datasetPath']
+    return dataset_path if dataset_path.startswith('files/') else f'files/{dataset_path}'
+
+
+def listing_key(item):
+    return str(item['datasetId']), str(item['datasetVersion']), posixpath.dirname(dataset_file_path(item))
+
+
+def listing_endpoint(item):
+    return f'{dataset_files_endpoint(item)}/browse'
+
+
+def listing_params(item, offset, page_size):
+    return {'path': posixpath.dirname(dataset_file_path(item)), 'limit': page_size, 'offset': offset}
+
+
+def add_listing_page(listing, json_data, offset):
+    """
+    Add the files of a page of a directory listing to listing.
+    Returns the offset of the next page, or None after the last page.
+    """
+    files = json_data.get('files', [])
+    for entry in files:
+        if entry.get('type', 'File') == 'File' and 'path' in entry:
+            listing[entry['path']] = entry
+
+    offset += len(files)
+    if not files or offset >= json_data.get('totalCount', 0):
+        return None
+
+    return offset
+
+
+def listed_metadata(listing, path):
+    """
+    Metadata of the file at path from listing, None if it is not listed or the listing does not carry checksums.
+    """
+    metadata = listing.get(path)
+    return metadata if metadata is not None and 'sha256' in metadata else None
+
+
+class FileMetadataResolver(object):
+
+    def __init__(self, ttl=DEFAULT_TTL, page_size=LISTING_PAGE_SIZE):
+        self._ttl = ttl
+        self._page_size = page_size
+        self._lock = threading.Lock()
+        self._listings = {}
+        self._listing_locks = {}
+
+    def _fetch_listing(self, item):
+        listing = {}
+        offset = 0
+        while offset is not None:
+            response = transport.get(listing_endpoint(item), params=listing_params(item, offset, self._page_size),
+                                     timeout=30)
+            if response.status_code != 200:
+                break
+
+            offset = add_listing_page(listing, response.json(), offset)
+
+        return listing
+
+    def _listing(self, item):
+        key = listing_key(item)
+        with self._lock:
+            cached = self._listings.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                return cached[1]
+            listing_lock = self._listing_locks.setdefault(key, threading.Lock())
+
+        # Only one thread fetches a given listing, the others wait for its result.
+        with listing_lock:
+            with self._lock:
+                cached = self._listings.get(key)
+                if cached is not None and cached[0] > time.monotonic():
+                    return cached[1]
+
+            listing = self._fetch_listing(item)
+            with self._lock:
+                self._listings[key] = (time.monotonic() + self._ttl, listing)
+
+        return listing
+
+    def _fetch_file(self, item):
+        response = transport.get(dataset_files_endpoint(item), params={'path': dataset_file_path(item)}, timeout=30)
+        return response.json()
+
+    def resolve(self, item):
+        """
+        Return the metadata, including 'sha256' and 'size', of the file described by item.
+        """
+        path = dataset_file_path(item)
+        listing = self._listing(item)
+        metadata = listed_metadata(listing, path)
+        if metadata is None:
+            # Not in the listing, or the listing does not carry checksums, ask for the file itself.
+            metadata = self._fetch_file(item)
+            with self._lock:
+                listing[path] = metadata
+
+        return metadata
+
+    def prefetch(self, items):
+        """
+        Fetch the listings needed by items on a background thread.
+        """
+        groups = {}
+        for item in items:
+            groups.setdefault(listing_key(item), item)
+
+        def _prefetch():
+            for item in groups.values():
+                try:
+                    self._listing(item)
+                except Exception as e:
+                    print("Handling unknown exception while prefetching file metadata:")
+                    print(e)
+
+        thread = threading.Thread(target=_prefetch, daemon=True)
+        thread.start()
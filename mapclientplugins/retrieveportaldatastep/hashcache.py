@@ -0,0 +1,132 @@
+"""
+Chunked SHA-256 hashing with a persistent cache of computed digests.
+"""
+import base64
+import hashlib
+import json
+import os
+import threading
+
+HASH_CHUNK_SIZE = 1024 * 1024
+MISSING_FILE_DIGEST = '---'
+
+
+def compute_sha256(file_path, chunk_size=HASH_CHUNK_SIZE, cancel_event=None):
+    """
+    Compute the base64 encoded SHA-256 digest of a file without reading it into memory all at once.
+    Returns None if cancel_event is set before the whole file has been read.
+    """
+    sha256_hash = hashlib.sha256()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(file_path, 'rb', buffering=0) as f:
+        while True:
+            if cancel_event is not None and cancel_event.is_set():
+                return None
+            size = f.readinto(buffer)
+            if not size:
+                break
+            sha256_hash.update(view[:size])
+
+    return base64.b64encode(sha256_hash.digest()).decode()
+
+
+def hash_cache_filename(settings_filename):
+    root, _ = os.path.splitext(settings_filename)
+    return f"{root}-hashes.json"
+
+
+def _file_identity(stat_result):
+    return [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino]
+
+
+class HashCache(object):
+    """
+    Digests of previously hashed files keyed by path and validated against the
+    file's size, modification time and inode.  An unchanged file only costs a
+    stat call to look up.
+    """
+
+    def __init__(self, cache_filename):
+        self._cache_filename = cache_filename
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        if not os.path.isfile(self._cache_filename):
+            return
+
+        try:
+            with open(self._cache_filename) as f:
+                self._entries = json.load(f).get('entries', {})
+        except (json.JSONDecodeError, OSError, AttributeError):
+            self._entries = {}
+
+    def get_sha256(self, file_path):
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return MISSING_FILE_DIGEST
+
+        key = os.path.abspath(file_path)
+        identity = _file_identity(stat_result)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[:3] == identity:
+                return entry[3]
+
+        digest = compute_sha256(file_path)
+        with self._lock:
+            self._entries[key] = identity + [digest]
+            self._dirty = True
+
+        return digest
+
+    def cached_sha256(self, file_path):
+        """
+        Return the digest of file_path if it is still valid, otherwise None, never hashing the file.
+        """
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(file_path))
+
+        return entry[3] if entry is not None and entry[:3] == _file_identity(stat_result) else None
+
+    def record(self, file_path, digest):
+        """
+        Remember a digest computed elsewhere for the current state of file_path.
+        """
+        try:
+            stat_result = os.stat(file_path)
+        except OSError:
+            return
+
+        with self._lock:
+            self._entries[os.path.abspath(file_path)] = _file_identity(stat_result) + [digest]
+            self._dirty = True
+
+    def discard(self, file_path):
+        with self._lock:
+            if self._entries.pop(os.path.abspath(file_path), None) is not None:
+                self._dirty = True
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            content = {'entries': dict(self._entries)}
+            self._dirty = False
+
+        temporary_filename = f"{self._cache_filename}.tmp"
+        try:
+            with open(temporary_filename, 'w') as f:
+                json.dump(content, f)
+            os.replace(temporary_filename, self._cache_filename)
+        except OSError as e:
+            print(f"Error saving hash cache: {e}")
@@ -0,0 +1,168 @@
+"""
+Check the files recorded in the download manifest against the output directory.
+
+Entries are grouped by directory and every directory is read with a single
+os.scandir, a file is then compared with the size recorded when it was
+downloaded.  Optionally the content is verified against the recorded sha256
+as well, files whose digest is still valid in the hash cache are not read
+again and the others are hashed in a thread pool, hashlib releases the GIL
+while it hashes each chunk.  Problems are yielded as they are found so that a
+caller can act on the first ones straight away.
+"""
+import concurrent.futures
+import os
+import posixpath
+import time
+
+from mapclientplugins.retrieveportaldatastep.hashcache import compute_sha256
+
+MISSING = 'missing'
+CORRUPT = 'corrupt'
+# Files queued for hashing, per worker thread.
+HASHES_PER_WORKER = 4
+# Seconds between progress reports.
+PROGRESS_INTERVAL = 1 / 15
+
+
+def _directory_entries(directory):
+    try:
+        with os.scandir(directory) as it:
+            return {entry.name: entry for entry in it}
+    except OSError:
+        return {}
+
+
+def _group_by_directory(manifest_entries):
+    directories = {}
+    for rel_path, item_data in manifest_entries.items():
+        directory, name = posixpath.split(rel_path)
+        directories.setdefault(directory, []).append((name, rel_path, item_data))
+
+    return directories
+
+
+def _item_weight(item_data):
+    # Progress is measured in bytes, a file of unknown size counts as one.
+    size = item_data.get('size')
+    return size if isinstance(size, int) and size > 0 else 1
+
+
+def _stat_problem(entry, item_data):
+    try:
+        if entry is None or not entry.is_file():
+            return MISSING
+        stat_result = entry.stat()
+    except OSError:
+        return MISSING
+
+    size = item_data.get('size')
+    if isinstance(size, int) and stat_result.st_size != size:
+        return CORRUPT
+
+    return None
+
+
+def scan_manifest(output_dir, manifest_entries, hash_cache=None, verify=False, cancel_event=None,
+                  max_workers=None, progress=None):
+    """
+    Generator yielding lists of (relative path, item, problem) for the manifest entries whose
+    file is missing or corrupt, problem is MISSING or CORRUPT.  A list is yielded for every
+    directory with problems, and when verifying, as digests that do not match are computed.
+
+    :param verify: If True also compare the content of files with a recorded sha256.
+    :param cancel_event: Scanning stops once this threading.Event is set.
+    :param progress: Called with the number of bytes checked and the total number of bytes.
+    """
+    workers = max_workers or os.cpu_count() or 1
+    executor = None
+    hashing = {}
+    total = sum(_item_weight(item_data) for item_data in manifest_entries.values())
+    checked = 0
+    last_report = 0.0
+
+    def report(force=False):
+        nonlocal last_report
+        now = time.monotonic()
+        if progress is not None and (force or now - last_report >= PROGRESS_INTERVAL):
+            last_report = now
+            progress(checked, total)
+
+    def finished_hashes(wait):
+        nonlocal checked
+        if not hashing:
+            return []
+
+        done, _ = concurrent.futures.wait(
+            hashing, return_when=concurrent.futures.FIRST_COMPLETED if wait else concurrent.futures.ALL_COMPLETED,
+            timeout=None if wait else 0)
+        problems = []
+        for future in done:
+            file_path, rel_path, item_data = hashing.pop(future)
+            checked += _item_weight(item_data)
+            try:
+                digest = future.result()
+            except OSError:
+                problems.append((rel_path, item_data, MISSING))
+                continue
+
+            if digest is None:
+                # Cancelled part way through the file.
+                continue
+
+            if hash_cache is not None:
+                hash_cache.record(file_path, digest)
+            if digest != item_data['sha256']:
+                problems.append((rel_path, item_data, CORRUPT))
+
+        report()
+        return problems
+
+    try:
+        for directory, expected in _group_by_directory(manifest_entries).items():
+            if cancel_event is not None and cancel_event.is_set():
+                return
+
+            entries = _directory_entries(os.path.join(output_dir, directory))
+            problems = []
+            for name, rel_path, item_data in expected:
+                sha256 = item_data.get('sha256')
+                problem = _stat_problem(entries.get(name), item_data)
+                if problem is not None or not verify or not sha256:
+                    checked += _item_weight(item_data)
+                    if problem is not None:
+                        problems.append((rel_path, item_data, problem))
+                    continue
+
+                file_path = os.path.join(output_dir, rel_path)
+                cached = None if hash_cache is None else hash_cache.cached_sha256(file_path)
+                if cached is not None:
+                    checked += _item_weight(item_data)
+                    if cached != sha256:
+                        problems.append((rel_path, item_data, CORRUPT))
+                    continue
+
+                if executor is None:
+                    executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+                # Hashing is bounded so that a huge manifest does not queue every file at once.
+                while len(hashing) >= HASHES_PER_WORKER * workers:
+                    if cancel_event is not None and cancel_event.is_set():
+                        return
+                    problems.extend(finished_hashes(wait=True))
+                future = executor.submit(compute_sha256, file_path, cancel_event=cancel_event)
+                hashing[future] = (file_path, rel_path, item_data)
+
+            problems.extend(finished_hashes(wait=False))
+            report()
+            if problems:
+                yield problems
+
+        while hashing:
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            problems = finished_hashes(wait=True)
+            if problems:
+                yield problems
+        report(force=True)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,194 @@
+"""
+Decode the items of one array in a JSON document while the document arrives.
+
+Only the structure of the document is scanned as the bytes are received, each
+item of the array at the requested path is decoded as soon as all of it has
+arrived.  Neither the raw body nor the whole decoded document has
+to be held before the first item can be used.  The rest of the document is
+decoded once the stream ends and is available as the document of the stream.
+"""
+import codecs
+import json
+import re
+
+_STRUCTURE = re.compile(r'["{}\[\]:,]')
+_STRING_END = re.compile(r'["\\]')
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def _string_end(text, start):
+    """
+    Return the position after the closing quote of the string starting at start,
+    or None if the string is not complete yet.
+    """
+    position = start + 1
+    while True:
+        match = _STRING_END.search(text, position)
+        if match is None:
+            return None
+        if match.group() == '"':
+            return match.end()
+        # Skip the escaped character.
+        position = match.end() + 1
+        if position > len(text):
+            return None
+
+
+def _set_path(document, path, value):
+    container = document
+    for key in path[:-1]:
+        container = container[key]
+    container[path[-1]] = value
+
+
+class StreamedArray(object):
+    """
+    Iterable over the items of the array found at path, a sequence of object
+    keys, in a JSON document made up of the given byte chunks.
+    Once iteration is complete document holds the decoded document, with the
+    array emptied unless keep_items is set.
+
+    :param chunks: Iterable of bytes making up the document.
+    :param path: Keys of the objects leading to the array.
+    :param keep_items: If True put the items back into the document.
+    :param on_complete: Optional callable taking the document once it is complete.
+    """
+
+    def __init__(self, chunks, path, keep_items=False, on_complete=None, encoding='utf-8'):
+        self._chunks = chunks
+        self._path = tuple(path)
+        self._keep_items = keep_items
+        self._on_complete = on_complete
+        self._encoding = encoding
+        self.document = None
+
+    def _at_path(self, stack):
+        return (len(stack) == len(self._path) and all(frame[0] == '{' for frame in stack)
+                and tuple(frame[1] for frame in stack) == self._path)
+
+    def __iter__(self):
+        text_decoder = codecs.getincrementaldecoder(self._encoding)()
+        buffer = ''
+        position = 0
+        # Frames of [container, current key, expecting a key].
+        stack = []
+        skeleton = []
+        segment_start = 0
+        in_array = False
+        # Length of text needed before trying to decode an incomplete item again.
+        retry_length = 0
+        items = []
+        chunks = iter(self._chunks)
+        finished = False
+        while not finished:
+            chunk = next(chunks, None)
+            if chunk is None:
+                buffer += text_decoder.decode(b'', final=True)
+                finished = True
+            else:
+                buffer += text_decoder.decode(chunk)
+
+            while True:
+                if in_array:
+                    position = _WHITESPACE.match(buffer, position).end()
+                    if position == len(buffer):
+                        break
+                    if buffer[position] == ',':
+                        position += 1
+                        continue
+                    if buffer[position] == ']':
+                        stack.pop()
+                        in_array = False
+                        segment_start = position
+                        position += 1
+                        continue
+                    if not finished and len(buffer) - position < retry_length:
+                        break
+
+                    try:
+                        item, end = _decoder.raw_decode(buffer, position)
+                    except json.JSONDecodeError:
+                        if finished:
+                            raise
+                        # The item has not arrived completely, try again once plenty more text has.
+                        retry_length = 2 * (len(buffer) - position)
+                        break
+
+                    # A number could still be continued by the next chunk.
+                    separator = _WHITESPACE.match(buffer, end).end()
+                    if separator == len(buffer) or buffer[separator] not in ',]':
+                        if finished:
+                            raise ValueError("JSON document ended unexpectedly.")
+                        retry_length = len(buffer) - position + 1
+                        break
+
+                    retry_length = 0
+                    position = end
+                    if self._keep_items:
+                        items.append(item)
+                    yield item
+                    continue
+
+                match = _STRUCTURE.search(buffer, position)
+                if match is None:
+                    position = len(buffer)
+                    break
+
+                index = match.start()
+                token = match.group()
+                if token == '"':
+                    end = _string_end(buffer, index)
+                    if end is None:
+                        # Wait for the rest of the string.
+                        position = index
+                        break
+                    if stack and stack[-1][0] == '{' and stack[-1][2]:
+                        stack[-1][1] = json.loads(buffer[index:end])
+                    position = end
+                    continue
+
+                position = index + 1
+                if token == '{':
+                    stack.append(['{', None, True])
+                elif token == '[':
+                    if self._at_path(stack):
+                        skeleton.append(buffer[segment_start:position])
+                        in_array = True
+                    stack.append(['[', None, False])
+                elif token in '}]':
+                    if stack:
+                        stack.pop()
+                elif token == ':':
+                    if stack:
+                        stack[-1][2] = False
+                elif stack and stack[-1][0] == '{':
+                    stack[-1][2] = True
+
+            # Drop the text that has been dealt with.
+            if not in_array:
+                skeleton.append(buffer[segment_start:position])
+            buffer = buffer[position:]
+            position = 0
+            segment_start = 0
+
+        if in_array or stack or buffer.strip():
+            raise ValueError("JSON document ended unexpectedly.")
+
+        self.document = json.loads(''.join(skeleton))
+        if self._keep_items:
+            _set_path(self.document, self._path, items)
+        if self._on_complete is not None:
+            self._on_complete(self.document)
+
+
+def decode(value):
+    """
+    Return the decoded document of value, reading it to the end first if it is a stream.
+    """
+    if isinstance(value, StreamedArray):
+        for _ in value:
+            pass
+        return value.document
+
+    return value
@@ -0,0 +1,113 @@
+"""
+Download manifest kept in memory with an append-only journal.
+
+Completed downloads are appended to a journal file next to the step settings
+instead of rewriting the whole settings file for every file.  The journal is
+folded back into the settings file (the 'manifest' entry) when it grows past a
+threshold or when the store is flushed, the settings file is always replaced
+atomically.
+"""
+import json
+import os
+
+COMPACT_THRESHOLD = 1000
+
+
+def manifest_journal_filename(settings_filename):
+    root, _ = os.path.splitext(settings_filename)
+    return f"{root}-manifest.journal"
+
+
+def load_settings(settings_filename):
+    if os.path.exists(settings_filename):
+        try:
+            with open(settings_filename) as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return {}
+    return {}
+
+
+def write_settings(settings_filename, settings, indent=None):
+    """
+    Write the settings to a temporary file and rename it over the settings file,
+    a reader never sees a partially written settings file.
+    """
+    temporary_filename = f"{settings_filename}.tmp"
+    with open(temporary_filename, 'w') as f:
+        json.dump(settings, f, indent=indent)
+    os.replace(temporary_filename, settings_filename)
+
+
+class ManifestStore(object):
+
+    def __init__(self, settings_filename):
+        self._settings_filename = settings_filename
+        self._journal_filename = manifest_journal_filename(settings_filename)
+        self._journal = None
+        self._journal_records = 0
+        settings = load_settings(settings_filename)
+        self._manifest = settings.get('manifest', {})
+        self._pending_downloads = settings.get('pending-downloads', {})
+        self._replay_journal()
+
+    def _replay_journal(self):
+        if not os.path.isfile(self._journal_filename):
+            return
+
+        with open(self._journal_filename) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A record cut short by a crash, everything before it is still valid.
+                    break
+                self._manifest[record['path']] = record['item']
+                self._journal_records += 1
+
+    def journal_filename(self):
+        return self._journal_filename
+
+    def entries(self):
+        return self._manifest
+
+    def add(self, rel_path, item_data):
+        self._manifest[rel_path] = item_data
+        try:
+            if self._journal is None:
+                self._journal = open(self._journal_filename, 'a')
+            self._journal.write(json.dumps({'path': rel_path, 'item': item_data}) + '\n')
+            self._journal.flush()
+            self._journal_records += 1
+        except OSError as e:
+            print(f"Error updating download manifest: {e}")
+
+        if self._journal_records >= COMPACT_THRESHOLD:
+            self.flush()
+
+    def pending_downloads(self):
+        return self._pending_downloads
+
+    def set_pending_downloads(self, pending_downloads):
+        self._pending_downloads = pending_downloads
+        self.flush()
+
+    def flush(self):
+        """
+        Fold the journal into the settings file and start a new journal.
+        """
+        settings = load_settings(self._settings_filename)
+        settings['manifest'] = self._manifest
+        settings['pending-downloads'] = self._pending_downloads
+        try:
+            write_settings(self._settings_filename, settings, indent=2)
+        except OSError as e:
+            print(f"Error updating download manifest: {e}")
+            return
+
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self._journal_filename):
+            os.remove(self._journal_filename)
+        self._journal_records = 0
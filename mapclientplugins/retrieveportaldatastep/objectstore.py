@@ -0,0 +1,114 @@
+"""
+Content addressed store for downloaded files.
+
+Files are stored once under their SHA-256 digest and materialised at their
+dataset location as hard links, or as copies where the file system does not
+support hard links.  A file whose digest is already in the store never needs
+to be transferred again.
+"""
+import base64
+import binascii
+import os
+import shutil
+
+from mapclientplugins.retrieveportaldatastep.hashcache import compute_sha256
+
+OBJECT_STORE_DIRNAME = '.objects'
+
+
+def _digest_hex(sha256):
+    try:
+        return base64.b64decode(sha256, validate=True).hex()
+    except (binascii.Error, ValueError):
+        return None
+
+
+class ObjectStore(object):
+
+    def __init__(self, root, hash_cache=None):
+        self._root = root
+        self._hash_cache = hash_cache
+
+    def object_path(self, sha256):
+        digest_hex = _digest_hex(sha256)
+        if not digest_hex:
+            return None
+
+        return os.path.join(self._root, digest_hex[:2], digest_hex)
+
+    def _sha256(self, file_path):
+        if self._hash_cache is None:
+            return compute_sha256(file_path)
+
+        return self._hash_cache.get_sha256(file_path)
+
+    def contains(self, sha256):
+        object_path = self.object_path(sha256)
+        if object_path is None or not os.path.isfile(object_path):
+            return False
+
+        # Objects are shared with their materialised files, make sure nobody has modified them since.
+        if self._sha256(object_path) != sha256:
+            os.remove(object_path)
+            return False
+
+        return True
+
+    def store(self, source, sha256):
+        """
+        Move source into the store if its content matches sha256.
+        Returns True if the store holds the content afterwards.
+        """
+        object_path = self.object_path(sha256)
+        if object_path is None or compute_sha256(source) != sha256:
+            return False
+
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        if os.path.isfile(object_path):
+            os.remove(source)
+        else:
+            os.replace(source, object_path)
+            if self._hash_cache is not None:
+                self._hash_cache.record(object_path, sha256)
+
+        return True
+
+    def adopt(self, file_path, sha256):
+        """
+        Add an existing file, already known to match sha256, to the store by hard linking it.
+        """
+        object_path = self.object_path(sha256)
+        if object_path is None or os.path.isfile(object_path):
+            return
+
+        try:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.link(file_path, object_path)
+            if self._hash_cache is not None:
+                self._hash_cache.record(object_path, sha256)
+        except OSError:
+            # Without hard links adopting would mean a copy, leave the file to be stored on its next download.
+            pass
+
+    def materialise(self, sha256, destination):
+        """
+        Place the stored content for sha256 at destination.
+        Returns False if the content is not in the store.
+        """
+        if not self.contains(sha256):
+            return False
+
+        object_path = self.object_path(sha256)
+        temporary_destination = f"{destination}.link"
+        if os.path.lexists(temporary_destination):
+            os.remove(temporary_destination)
+        try:
+            os.link(object_path, temporary_destination)
+        except OSError:
+            shutil.copy2(object_path, temporary_destination)
+        os.replace(temporary_destination, destination)
+        if self._hash_cache is not None:
+            # The destination holds the stored content, its digest does not need to be computed again.
+            self._hash_cache.record(destination, sha256)
+
+        return True
@@ -0,0 +1,179 @@
+"""
+Filter search results by wildcard patterns over an index of their columns.
+
+The values of a column are lower-cased and joined into large strings, one
+value per line, with the offset of every value kept alongside.  A filter is
+compiled once when it changes and is run over the joined strings, so the
+regular expression engine skips non-matching rows without a call per row.
+The matching rows are collected into a set that the proxy model consults.
+"""
+import bisect
+import itertools
+import re
+
+# Rows joined into one string, the last string is rebuilt while it is smaller than this.
+SEGMENT_ROWS = 4096
+_WILDCARD_CHARACTERS = set('*?[')
+
+
+def _character_class(body):
+    negate = body[:1] in ('!', '^')
+    if negate:
+        body = body[1:]
+    body = body.replace('\\', '\\\\').replace('[', '\\[').replace('^', '\\^')
+    # Like the other wildcards a negated set does not match the path separator, nor cross into another row.
+    return f"[^/\n{body}]" if negate else f"[{body}]"
+
+
+def wildcard_pattern(pattern):
+    """
+    Compile a wildcard pattern, interpreted as QRegularExpression.fromWildcard does for an
+    unanchored, case insensitive conversion, to a Python regular expression.
+    """
+    parts = []
+    position = 0
+    while position < len(pattern):
+        character = pattern[position]
+        if character == '*':
+            parts.append('[^/\n]*')
+        elif character == '?':
+            parts.append('[^/\n]')
+        elif character == '[':
+            body_start = position + 1
+            if pattern[body_start:body_start + 1] in ('!', '^'):
+                body_start += 1
+            # A closing bracket straight after the opening one is part of the set.
+            end = pattern.find(']', body_start + 1)
+            if end == -1:
+                parts.append(re.escape(character))
+            else:
+                parts.append(_character_class(pattern[position + 1:end]))
+                position = end
+        else:
+            parts.append(re.escape(character))
+        position += 1
+
+    return re.compile(''.join(parts), re.IGNORECASE)
+
+
+def _compile_matcher(filter_text):
+    """
+    Return a callable taking (text, position) returning the position of the next match or -1.
+    """
+    if _WILDCARD_CHARACTERS.isdisjoint(filter_text):
+        needle = filter_text.lower()
+        return lambda text, position: text.find(needle, position)
+
+    regex = wildcard_pattern(filter_text)
+
+    def _search(text, position):
+        match = regex.search(text, position)
+        return -1 if match is None else match.start()
+
+    return _search
+
+
+class _Segment(object):
+    __slots__ = ('first_row', 'text', 'offsets')
+
+    def __init__(self, first_row, values):
+        self.first_row = first_row
+        lowered = [f"{value}".lower() for value in values]
+        self.text = '\n'.join(lowered)
+        self.offsets = list(itertools.accumulate((len(value) + 1 for value in lowered[:-1]), initial=0))
+
+    def row_count(self):
+        return len(self.offsets)
+
+
+class _ColumnIndex(object):
+
+    def __init__(self, values):
+        self.values = values
+        self._segments = []
+        self._row_count = 0
+
+    def update(self):
+        """
+        Index the values added to the column since the last update.
+        """
+        if len(self.values) == self._row_count:
+            return
+
+        first_row = self._row_count
+        if self._segments and self._segments[-1].row_count() < SEGMENT_ROWS:
+            first_row = self._segments.pop().first_row
+
+        self._segments.append(_Segment(first_row, self.values[first_row:]))
+        self._row_count = len(self.values)
+
+    def matching_rows(self, matcher, first_row=0):
+        rows = []
+        for segment in self._segments:
+            segment_rows = segment.row_count()
+            if segment.first_row + segment_rows <= first_row:
+                continue
+
+            offsets = segment.offsets
+            row = max(0, first_row - segment.first_row)
+            while row < segment_rows:
+                found = matcher(segment.text, offsets[row])
+                if found == -1:
+                    break
+                row = bisect.bisect_right(offsets, found) - 1
+                rows.append(segment.first_row + row)
+                row += 1
+
+        return rows
+
+
+class ResultFilter(object):
+    """
+    Decide which rows pass the current filter.  Rows are evaluated in bulk, when the
+    filter changes and when rows beyond those already evaluated are asked about.
+
+    :param column_values: Callable taking a column returning the list of its values.
+    """
+
+    def __init__(self, column_values):
+        self._column_values = column_values
+        self._indexes = {}
+        self._columns = []
+        self._matcher = None
+        self._accepted = set()
+        self._evaluated = 0
+
+    def set_filter(self, columns, filter_text):
+        self._columns = list(columns)
+        self._matcher = _compile_matcher(filter_text) if filter_text else None
+        self._accepted = set()
+        self._evaluated = 0
+
+    def _index(self, column):
+        values = self._column_values(column)
+        index = self._indexes.get(column)
+        # Clearing the results replaces the column lists, the index then starts over.
+        if index is None or index.values is not values:
+            index = _ColumnIndex(values)
+            self._indexes[column] = index
+            self._accepted = set()
+            self._evaluated = 0
+
+        index.update()
+        return index
+
+    def _evaluate(self):
+        indexes = [self._index(column) for column in self._columns]
+        for index in indexes:
+            self._accepted.update(index.matching_rows(self._matcher, self._evaluated))
+        self._evaluated = len(indexes[0].values)
+
+    def accepts(self, row):
+        if self._matcher is None or not self._columns:
+            return True
+
+        index = self._indexes.get(self._columns[0])
+        if row >= self._evaluated or index is None or index.values is not self._column_values(self._columns[0]):
+            self._evaluate()
+
+        return row in self._accepted
@@ -1,26 +1,36 @@
-import base64
-import hashlib
 import json
 import os
-import pathlib
-
-import requests
 import threading
 
-from urllib.parse import urlparse
-
-from PySide6 import QtCore, QtGui, QtWidgets
+from PySide6 import QtCore, QtWidgets
 
+from mapclientplugins.retrieveportaldatastep import transport
 from mapclientplugins.retrieveportaldatastep.ui_retrieveportaldatawidget import Ui_RetrievePortalDataWidget
-from mapclientplugins.retrieveportaldatastep.definitions import DEFAULT_VALUE, DEFAULT_HEADERS
-from mapclientplugins.retrieveportaldatastep.scicrunch_requests import create_filter_request, \
-    form_scicrunch_match_request
 from mapclientplugins.retrieveportaldatastep.downloadprogressdialog import DownloadProgressDialog
+from mapclientplugins.retrieveportaldatastep.downloadscheduler import DownloadScheduler
+from mapclientplugins.retrieveportaldatastep.engine import FileDownloader, ZipBatchDownloader, \
+    scicrunch_search_pages, pennsieve_file_search_pages, standardise_doi_form, group_download_items, \
+    download_unit_priority, download_host, partial_filename, form_local_destination, manifest_key, \
+    set_search_cache_directory, SEARCH_CACHE_DIRNAME
+from mapclientplugins.retrieveportaldatastep.asyncdownload import AsyncDownloadEngine, \
+    available as asyncio_downloads_available
+from mapclientplugins.retrieveportaldatastep.manifest import ManifestStore
+from mapclientplugins.retrieveportaldatastep.searchhistory import SearchHistory, SEARCH_HISTORY_FILENAME
+from mapclientplugins.retrieveportaldatastep.searchcache import OfflineCacheMiss
+from mapclientplugins.retrieveportaldatastep.completion import CompletionEngine
+from mapclientplugins.retrieveportaldatastep.searchresultmodel import SearchResultModel
+from mapclientplugins.retrieveportaldatastep.filebrowsermodel import OutputDirectoryModel
+from mapclientplugins.retrieveportaldatastep.stepsettings import DEFAULT_MAX_CONCURRENT_DOWNLOADS, \
+    DEFAULT_MAX_DOWNLOADS_PER_HOST, DEFAULT_MAX_ASYNC_DOWNLOADS, DEFAULT_MAX_ASYNC_DOWNLOADS_PER_HOST, \
+    SOURCE_FILESYSTEM, SOURCE_MANIFEST
+from mapclientplugins.retrieveportaldatastep.resultfilter import ResultFilter
+from mapclientplugins.retrieveportaldatastep.objectstore import ObjectStore, OBJECT_STORE_DIRNAME
+from mapclientplugins.retrieveportaldatastep.filemetadata import FileMetadataResolver
+from mapclientplugins.retrieveportaldatastep.hashcache import HashCache, hash_cache_filename
+from mapclientplugins.retrieveportaldatastep.integrityscan import scan_manifest
 
 from mapclient.settings.general import get_data_directory
 
-POSSIBLE_DOI_SUFFIXES = ["DOI:", "https://doi.org/", "http://dx.doi.org/"]
-
 SPECIES = [
     "Cat",
     "Dog",
@@ -38,7 +48,12 @@ ORGANS = [
     "Lung",
 ]
 SEARCH_BANK_FILENAME = "retrieveportaldata-search-bank.json"
-API_KEY_NAME = "SCICRUNCH_API_KEY"
+# Milliseconds to wait after the last edit of the result filter before applying it.
+FILTER_DEBOUNCE_INTERVAL = 250
+# Resolution of the verification progress bar, byte counts overflow its integer range.
+VERIFY_PROGRESS_STEPS = 1000
+
+_search_history = None
 
 
 def _create_filter_menu(parent, labels):
@@ -50,40 +65,15 @@ def _create_filter_menu(parent, labels):
     return filter_menu
 
 
-def _initialise_search_bank():
-    search_bank_file = os.path.join(get_data_directory(), SEARCH_BANK_FILENAME)
-    if not os.path.isfile(search_bank_file):
-        with open(search_bank_file, "w") as fh:
-            json.dump({}, fh)
-
-
-def _search_bank():
-    with open(os.path.join(get_data_directory(), SEARCH_BANK_FILENAME)) as fh:
-        search_bank = json.load(fh)
-
-    return search_bank
-
+def _get_search_history():
+    global _search_history
+    if _search_history is None:
+        data_directory = get_data_directory()
+        _search_history = SearchHistory(os.path.join(data_directory, SEARCH_HISTORY_FILENAME))
+        # Carry over the searches made with earlier versions.
+        _search_history.import_search_bank(os.path.join(data_directory, SEARCH_BANK_FILENAME))
 
-def _update_search_bank(search_bank):
-    with open(os.path.join(get_data_directory(), SEARCH_BANK_FILENAME), "w") as fh:
-        json.dump(search_bank, fh)
-
-
-def _word_bank(key):
-    search_bank = _search_bank()
-    return search_bank.get(key, [])
-
-
-def _save_to_search_bank(key, value):
-    search_bank = _search_bank()
-
-    existing = search_bank.get(key, [])
-    if not existing:
-        search_bank[key] = existing
-
-    if value not in existing:
-        existing.append(value)
-        _update_search_bank(search_bank)
+    return _search_history
 
 
 def _extract_facets(tool_button):
@@ -96,205 +86,108 @@ def _extract_facets(tool_button):
     return facets
 
 
-def _do_scicrunch_request(req):
-    base_url = "https://scicrunch.org/api/1/elastic/SPARC_PortalDatasets_pr/_search"
-    params = {
-        "api_key": os.environ.get(API_KEY_NAME, DEFAULT_VALUE),
-    }
-    headers = DEFAULT_HEADERS
-    return requests.post(base_url, json=req, params=params, headers=headers)
-
-
-def _standardise_doi_form(text):
-    for suffix in POSSIBLE_DOI_SUFFIXES:
-        if text.startswith(suffix):
-            text = text.replace(suffix, "")
-            text = text.strip()
-
-    return text
-
+class SearchSignals(QtCore.QObject):
+    page = QtCore.Signal(int, object)
+    # Generation and a message for the user.
+    error = QtCore.Signal(int, str)
+    finished = QtCore.Signal(int)
 
-def _create_search_result(obj, result):
-    return {
-        "name": obj["name"],
-        "datasetId": result["_source"]["object_id"],
-        "datasetVersion": result["_source"]["pennsieve"]["version"]["identifier"],
-        "mimetype": obj["additional_mimetype"]["name"] if obj["additional_mimetype"]["name"] else obj["mimetype"][
-            "name"],
-        "datasetPath": obj["dataset"]["path"],
-        "uri": "",
-    }
 
+class SearchTask(QtCore.QRunnable):
+    """
+    Retrieve the pages of a search off the GUI thread.
+    Every signal carries the generation of the search so that the receiver can
+    discard results from searches that have since been superseded.
+    """
 
-def _return_scicrunch_search_result(search_text, search_type, facets):
-    result_size = 100
-    target_field_parts = []
-    req = {}
-    if search_type == "mimetype":
-        target_field_location = "objects.additional_mimetype.name"
-        target_field_parts = target_field_location.split(".")[1:]
-        req = create_filter_request(search_text, facets, result_size, 0, fields=[target_field_location])
-    elif search_type == "DOI":
-        source_fields = [
-            "object_id",
-            "pennsieve.version.identifier",
-            "item.curie",
-            "item.name",
-            "objects.name",
-            "objects.mimetype.name",
-            "objects.additional_mimetype.name",
-            "objects.dataset.path"
-        ]
-        req = form_scicrunch_match_request("item.curie", search_text, source_fields, size=result_size, start=0)
-    else:
-        print("Something has gone wrong!", search_type, "is not a handled search type.")
-
-    response = _do_scicrunch_request(req)
-    return response.json(), result_size, target_field_parts
-
+    def __init__(self, generation, search_pages, cancel_event: threading.Event):
+        super().__init__()
+        self._generation = generation
+        self._search_pages = search_pages
+        self._cancel_event = cancel_event
+        self.signals = SearchSignals()
 
-def _scicrunch_search(search_text, search_type, facets=None):
-    post_result, result_size, target_field_parts = _return_scicrunch_search_result(search_text, search_type, facets)
-    search_result = []
-    if "hits" in post_result and post_result["hits"]["total"] > 0:
-        for hit_index in range(min(result_size, post_result["hits"]["total"])):
-            result = post_result["hits"]["hits"][hit_index]
-            source = result["_source"]
+    def run(self):
+        try:
+            for page in self._search_pages:
+                if self._cancel_event.is_set():
+                    break
+                self.signals.page.emit(self._generation, page)
+        except OfflineCacheMiss:
+            self.signals.error.emit(self._generation,
+                                    "No cached results for this search, uncheck Offline to search the portal.")
+        except Exception as e:
+            print("Handling unknown exception in SearchTask:")
+            print(e)
+            self.signals.error.emit(self._generation, f"Search failed: {e}")
+        finally:
+            self.signals.finished.emit(self._generation)
 
-            for obj in source["objects"]:
 
-                if obj["mimetype"]["name"] != "inode/directory":
-                    if search_type == "mimetype":
-                        target_field_value = obj
-                        for field in target_field_parts:
-                            target_field_value = target_field_value.get(field, {})
-                        if target_field_value == search_text:
-                            search_result.append(_create_search_result(obj, result))
-                    elif search_type == "DOI":
-                        search_result.append(_create_search_result(obj, result))
-    else:
-        print("Got nothing.")
+class DownloadSignals(QtCore.QObject):
+    # Local destination and the number of bytes of it received so far.
+    progress = QtCore.Signal(str, float)
+    finished = QtCore.Signal(str, str)
 
-    return search_result
 
+class FileDownloadTask(QtCore.QRunnable):
 
-def _determine_dataset_path(uri):
-    if uri:
-        parsed_object = urlparse(uri)
-        return parsed_object.path.split("files/")[1]
+    def __init__(self, item, output_dir, cancel_event: threading.Event, hash_cache=None, metadata_resolver=None,
+                 object_store=None):
+        super().__init__()
+        self.signals = DownloadSignals()
+        self._downloader = FileDownloader(item, output_dir, cancel_event, hash_cache, metadata_resolver, object_store,
+                                          self.signals.progress.emit, self.signals.finished.emit)
 
-    return ''
+    def run(self):
+        self._downloader.run()
 
 
-def get_sha256(file_path):
-    if not os.path.isfile(file_path):
-        return '---'
+class ZipBatchDownloadTask(QtCore.QRunnable):
 
-    with open(file_path, 'rb') as f:
-        buf = f.read()
-        sha256_hash = hashlib.sha256(buf).digest()
+    def __init__(self, items, output_dir, cancel_event: threading.Event, hash_cache=None, metadata_resolver=None,
+                 object_store=None):
+        super().__init__()
+        self.signals = DownloadSignals()
+        self._downloader = ZipBatchDownloader(items, output_dir, cancel_event, hash_cache, metadata_resolver,
+                                              object_store, self.signals.progress.emit, self.signals.finished.emit)
 
-    return base64.b64encode(sha256_hash).decode()
-
-
-def _form_pennsieve_download_file_endpoint(item):
-    return f'https://api.pennsieve.io/discover/datasets/{item["datasetId"]}/versions/{item["datasetVersion"]}/files'
-
-
-def safe_makedirs(path):
-    try:
-        os.makedirs(path, exist_ok=True)
-    except FileExistsError:
-        # Another thread might have created it between the check and the call
-        pass
+    def run(self):
+        self._downloader.run()
 
 
-class DownloadSignals(QtCore.QObject):
-    progress = QtCore.Signal(str, float)
-    finished = QtCore.Signal(str, str)
+class IntegrityScanSignals(QtCore.QObject):
+    problems = QtCore.Signal(object)
+    # Bytes checked so far and the total number of bytes.
+    progress = QtCore.Signal(float, float)
+    finished = QtCore.Signal()
 
 
-class FileDownloadTask(QtCore.QRunnable):
+class IntegrityScanTask(QtCore.QRunnable):
+    """
+    Check the downloaded files against the manifest off the GUI thread,
+    reporting missing or corrupt files as they are found.
+    """
 
-    def __init__(self, item, output_dir, cancel_event: threading.Event):
+    def __init__(self, output_dir, manifest_entries, hash_cache, cancel_event: threading.Event, verify=False):
         super().__init__()
-        self._item = item
         self._output_dir = output_dir
+        self._manifest_entries = manifest_entries
+        self._hash_cache = hash_cache
         self._cancel_event = cancel_event
-        self.signals = DownloadSignals()
+        self._verify = verify
+        self.signals = IntegrityScanSignals()
 
     def run(self):
-        # If cancellation was already requested before this task started, exit early
-        if self._cancel_event.is_set():
-            return
-
-        local_destination = "error"
-        was_cancelled = False
-
         try:
-            local_destination = _form_local_destination(self._output_dir, self._item)
-            local_dir = os.path.dirname(local_destination)
-            safe_makedirs(local_dir)
-
-            uri = _form_pennsieve_download_file_endpoint(self._item)
-            params = (
-                {'path': self._item['datasetPath']}
-                if self._item['datasetPath'].startswith('files/')
-                else {'path': f'files/{self._item["datasetPath"]}'}
-            )
-
-            response = requests.get(uri, params=params, stream=True)
-
-            json_data = response.json()
-            if json_data.get('sha256', '') != get_sha256(local_destination):
-                req = {
-                    "data": {
-                        "paths": [params['path']],
-                        "datasetId": self._item['datasetId'],
-                        "version": self._item['datasetVersion'],
-                    }
-                }
-                discover_zipit_url = "https://api.pennsieve.io/zipit/discover"
-                headers = {"content-type": "application/json"}
-                last_emitted_progress = -1
-
-                # Use requests with a timeout so threads don't hang indefinitely on bad connections.
-                with requests.post(
-                    discover_zipit_url, json=req, headers=headers, stream=True, timeout=10
-                ) as response:
-                    response.raise_for_status()
-
-                    file_size = json_data.get('size', 0)
-                    bytes_downloaded = 0
-                    # Write chunks to disk and check cancellation flag periodically.
-                    with open(local_destination, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=64 * 1024):  # 64 KB chunks
-                            if self._cancel_event.is_set():
-                                was_cancelled = True
-                                break
-                            if chunk:
-                                bytes_downloaded += len(chunk)
-                                f.write(chunk)
-                                current_progress = bytes_downloaded / file_size
-                                if current_progress > 1.1 * last_emitted_progress:
-                                    self.signals.progress.emit(local_destination, current_progress)
-                                    last_emitted_progress = current_progress
-
+            for problems in scan_manifest(self._output_dir, self._manifest_entries, self._hash_cache, self._verify,
+                                          self._cancel_event, progress=self.signals.progress.emit):
+                self.signals.problems.emit(problems)
         except Exception as e:
-            print("Handling unknown exception in FileDownloadTask:")
+            print("Handling unknown exception in IntegrityScanTask:")
             print(e)
-
         finally:
-            if was_cancelled:
-                # Cleanup partially downloaded file on cancellation.
-                if os.path.exists(local_destination) and local_destination != "error":
-                    try:
-                        os.remove(local_destination)
-                    except OSError:
-                        pass
-            else:
-                # Only emit finished signal if the download wasn't cancelled.
-                self.signals.finished.emit(local_destination, json.dumps(self._item))
+            self.signals.finished.emit()
 
 
 class SearchResultFilterProxy(QtCore.QSortFilterProxyModel):
@@ -304,10 +197,18 @@ class SearchResultFilterProxy(QtCore.QSortFilterProxyModel):
 
         self._row = -1
         self._filter = ""
+        self._result_filter = None
+
+    def setSourceModel(self, source_model):
+        super().setSourceModel(source_model)
+        self._result_filter = ResultFilter(source_model.column_values)
 
     def set_filter_on_row(self, row, filter_text):
         self._row = row
         self._filter = filter_text
+        columns = range(self.sourceModel().columnCount()) if row == -1 else [row]
+        # The pattern is compiled once here, not for every row that is filtered.
+        self._result_filter.set_filter(columns, filter_text)
         self.invalidateFilter()
 
     def filterAcceptsRow(self, source_row, source_parent):
@@ -315,76 +216,98 @@ class SearchResultFilterProxy(QtCore.QSortFilterProxyModel):
         if self._filter == "":
             return True
 
-        model = self.sourceModel()
-
-        if self._row == -1:
-            all_text = [model.index(source_row, column).data() or "" for column in range(model.columnCount())]
-            text = ' '.join(all_text)
-        else:
-            text = model.index(source_row, self._row).data() or ""
-
-        reg_exp = QtCore.QRegularExpression.fromWildcard(
-            self._filter,
-            options=QtCore.QRegularExpression.WildcardConversionOption.UnanchoredWildcardConversion
-        )
-
-        return reg_exp.match(text).hasMatch()
+        return self._result_filter.accepts(source_row)
 
 
 class RetrievePortalDataWidget(QtWidgets.QWidget):
 
-    def __init__(self, output_dir, output_files, settings_filename, parent=None):
+    def __init__(self, output_dir, output_files, settings_filename, parent=None,
+                 max_concurrent_downloads=DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+                 max_downloads_per_host=DEFAULT_MAX_DOWNLOADS_PER_HOST, asyncio_downloads=False,
+                 file_browser_source=SOURCE_FILESYSTEM, max_async_downloads=DEFAULT_MAX_ASYNC_DOWNLOADS,
+                 max_async_downloads_per_host=DEFAULT_MAX_ASYNC_DOWNLOADS_PER_HOST):
         QtWidgets.QWidget.__init__(self, parent)
 
         self._model = None
         self._proxy_model = None
         self._selection_model = None
-        self._list_files = None
+        self._search_generation = 0
+        self._search_cancel_event = None
+        self._search_results_shown = False
         self._callback = None
-        self._cancel_event = None
+        self._download_scheduler = DownloadScheduler(max_concurrent_downloads, max_downloads_per_host, self)
+        self._async_download_engine = None
+        if asyncio_downloads:
+            if asyncio_downloads_available():
+                self._async_download_engine = AsyncDownloadEngine(max_async_downloads, max_async_downloads_per_host)
+                # The event loop thread and its connections go with the widget.
+                self.destroyed.connect(self._async_download_engine.close)
+            else:
+                print("Event loop downloads need aiohttp, downloading with a thread per download instead.")
+        self._pending_downloads = {}
+        self._scan_cancel_event = None
+        self._restore_items = []
+        self._restore_reply = None
+        self._restore_prompting = False
+        self._verify_cancel_event = None
+        self._verify_dialog = None
+        self._verify_problems = []
         self._completing = False
         self._dataset_id_completing = False
         self._output_dir = output_dir
         self._settings_filename = settings_filename
+        self._manifest = ManifestStore(settings_filename)
+        self._hash_cache = HashCache(hash_cache_filename(settings_filename))
+        self._metadata_resolver = FileMetadataResolver()
+        self._object_store = ObjectStore(os.path.join(output_dir, OBJECT_STORE_DIRNAME), self._hash_cache)
+
+        set_search_cache_directory(os.path.join(get_data_directory(), SEARCH_CACHE_DIRNAME))
 
         self._ui = Ui_RetrievePortalDataWidget()
         self._ui.setupUi(self)
         self._ui.toolButtonFilterSpecies.setMenu(_create_filter_menu(self._ui.toolButtonFilterSpecies, SPECIES))
         self._ui.toolButtonFilterOrgan.setMenu(_create_filter_menu(self._ui.toolButtonFilterOrgan, ORGANS))
 
-        _initialise_search_bank()
-
-        self._completer = QtWidgets.QCompleter()
-        self._completer.setCaseSensitivity(QtCore.Qt.CaseSensitivity.CaseInsensitive)
-        self._completer.setFilterMode(QtCore.Qt.MatchFlag.MatchContains)
+        # Completions come ranked from the completion engine, the completers only display them.
+        self._completion_engine = CompletionEngine()
+        self._completion_engine.load_in_background(_get_search_history())
+        self._search_completer_model = QtCore.QStringListModel()
+        self._completer = QtWidgets.QCompleter(self._search_completer_model)
+        self._completer.setCompletionMode(QtWidgets.QCompleter.CompletionMode.UnfilteredPopupCompletion)
         self._completer.setWidget(self._ui.lineEditSearch)
-        self._search_completer_model = None
-        self._update_completer_model(self._ui.comboBoxSearchBy.currentText())
 
-        self._dataset_id_completer = QtWidgets.QCompleter(_word_bank('dataset-id'))
-        self._dataset_id_completer.setCaseSensitivity(QtCore.Qt.CaseSensitivity.CaseInsensitive)
-        self._dataset_id_completer.setFilterMode(QtCore.Qt.MatchFlag.MatchContains)
+        self._dataset_id_completer_model = QtCore.QStringListModel()
+        self._dataset_id_completer = QtWidgets.QCompleter(self._dataset_id_completer_model)
+        self._dataset_id_completer.setCompletionMode(QtWidgets.QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self._dataset_id_completer.setWidget(self._ui.lineEditDatasetID)
 
-        file_browser_model = QtWidgets.QFileSystemModel()
-        file_browser_model.setRootPath(QtCore.QDir.rootPath())
-        self._ui.treeViewFileBrowser.setModel(file_browser_model)
-        self._ui.treeViewFileBrowser.setRootIndex(file_browser_model.index(self._output_dir))
+        # Only the output directory is shown, its directories are listed as they are expanded.
+        manifest_entries = self._manifest.entries() if file_browser_source == SOURCE_MANIFEST else None
+        self._file_browser_model = OutputDirectoryModel(self._output_dir, manifest_entries, self)
+        self._ui.treeViewFileBrowser.setModel(self._file_browser_model)
 
         list_model = QtCore.QStringListModel(output_files)
         self._ui.listViewProvidedFiles.setModel(list_model)
 
+        self._setup_search_result_table()
         self._make_connections()
         self._update_ui()
 
+        # Open connections to the portal services while the user is setting up their search.
+        transport.set_pool_size(self._download_scheduler.max_concurrent())
+        transport.warm_up()
+
         # Check for missing cached files on startup.
         QtCore.QTimer.singleShot(100, self._check_and_restore_cache)
 
     def _make_connections(self):
         self._ui.pushButtonSearch.clicked.connect(self._search_button_clicked)
+        self._ui.pushButtonCancelSearch.clicked.connect(self._cancel_search_button_clicked)
         self._ui.pushButtonDownload.clicked.connect(self._download_button_clicked)
         self._ui.pushButtonDone.clicked.connect(self._done_button_clicked)
         self._ui.comboBoxSearchBy.currentTextChanged.connect(self._search_by_changed)
         self._ui.lineEditSearch.textChanged.connect(self._search_text_changed)
+        self._ui.lineEditDatasetID.textChanged.connect(self._dataset_id_text_changed)
         self._ui.treeViewFileBrowser.expanded.connect(self._file_browser_expanded)
         self._completer.activated.connect(self._handle_completion)
         self._dataset_id_completer.activated.connect(self._handle_dataset_id_completion)
@@ -396,6 +319,11 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
         self._provide_selection_model = self._ui.listViewProvidedFiles.selectionModel()
         self._provide_selection_model.selectionChanged.connect(self._update_ui)
         self._ui.comboBoxSearchResultFilter.currentIndexChanged.connect(self._search_result_filter_changed)
+        self._selection_model.selectionChanged.connect(self._update_ui)
+        self._ui.pushButtonClearSelection.clicked.connect(self._selection_model.clearSelection)
+        self._ui.pushButtonSelectAll.clicked.connect(self._select_all_search_results)
+        self._ui.lineEditSearchResultFilter.textEdited.connect(self._filter_search_results)
+        self._filter_timer.timeout.connect(self._search_result_filter_changed)
 
     def _update_ui(self):
         results_available = self._proxy_model.rowCount() > 0 if self._proxy_model else False
@@ -412,6 +340,8 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
         self._ui.pushButtonTransferIn.setEnabled(transfer_in)
         self._ui.pushButtonTransferOut.setEnabled(transfer_out)
         self._ui.pushButtonSearch.setEnabled(search_text)
+        self._ui.pushButtonCancelSearch.setEnabled(self._search_cancel_event is not None)
+        self._ui.pushButtonDone.setEnabled(self._verify_cancel_event is None)
         self._ui.pushButtonClearSelection.setEnabled(ready)
         self._ui.pushButtonSelectAll.setEnabled(results_available)
         self._ui.lineEditSearchResultFilter.setEnabled(results_available)
@@ -421,24 +351,9 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
         if index.isValid() and index.column() == 0:
             self._ui.treeViewFileBrowser.resizeColumnToContents(0)
 
-    def _set_table(self, file_list):
-        self._model = QtGui.QStandardItemModel(0, 4)
-        self._model.setHorizontalHeaderLabels(['Filename', 'Dataset ID', 'Dataset Version', 'Mimetype', 'Dataset Path'])
-        for row, file_info in enumerate(file_list):
-            item = QtGui.QStandardItem(f"{file_info['name']}")
-            item.setData(file_info, QtCore.Qt.ItemDataRole.UserRole)
-            self._model.setItem(row, 0, item)
-            item = QtGui.QStandardItem(f"{file_info['datasetId']}")
-            self._model.setItem(row, 1, item)
-            item = QtGui.QStandardItem(f"{file_info['datasetVersion']}")
-            self._model.setItem(row, 2, item)
-            mimetype_approx = file_info.get('mimetype', file_info.get('fileType', ''))
-            item = QtGui.QStandardItem(f"{mimetype_approx}")
-            self._model.setItem(row, 3, item)
-            dataset_path = file_info.get('datasetPath', _determine_dataset_path(file_info['uri']))
-            item = QtGui.QStandardItem(f"{dataset_path}")
-            self._model.setItem(row, 4, item)
-
+    def _setup_search_result_table(self):
+        # The models live as long as the widget, a new search only replaces their contents.
+        self._model = SearchResultModel(self)
         self._proxy_model = SearchResultFilterProxy(self)
         self._proxy_model.setSourceModel(self._model)
         self._ui.tableViewSearchResult.setModel(self._proxy_model)
@@ -446,13 +361,24 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
             QtWidgets.QHeaderView.ResizeMode.ResizeToContents)
         self._ui.tableViewSearchResult.horizontalHeader().setStretchLastSection(True)
         self._selection_model = self._ui.tableViewSearchResult.selectionModel()
-        self._selection_model.selectionChanged.connect(self._update_ui)
-        self._ui.pushButtonClearSelection.clicked.connect(self._selection_model.clearSelection)
-        self._ui.pushButtonSelectAll.clicked.connect(self._select_all_search_results)
-        self._ui.lineEditSearchResultFilter.textEdited.connect(self._filter_search_results)
+        self._filter_timer = QtCore.QTimer(self)
+        self._filter_timer.setSingleShot(True)
+        self._filter_timer.setInterval(FILTER_DEBOUNCE_INTERVAL)
+
+    def _set_table(self, file_list):
+        self._model.clear()
+        self._model.append(file_list)
+
+    def _append_to_table(self, file_list):
+        self._model.append(file_list)
+
+    def _selected_search_results(self):
+        rows = sorted(self._proxy_model.mapToSource(index).row() for index in self._selection_model.selectedRows())
+        return [self._model.item(row) for row in rows]
 
     def _filter_search_results(self):
-        self._search_result_filter_changed()
+        # Wait for a pause in typing rather than filtering on every keystroke.
+        self._filter_timer.start()
 
     def _search_result_filter_changed(self):
         filter_type_map = {
@@ -465,6 +391,8 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
         self._proxy_model.set_filter_on_row(filter_type_map.get(current_filter, -1), current_text)
 
     def _select_all_search_results(self):
+        # Select every result, not only those the view has fetched so far.
+        self._model.fetch_all()
         top_left = self._proxy_model.index(0, 0)
         bottom_right = self._proxy_model.index(self._proxy_model.rowCount() - 1, self._proxy_model.columnCount() - 1)
         selection = QtCore.QItemSelection(top_left, bottom_right)
@@ -503,76 +431,102 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
         dataset_id = self._ui.lineEditDatasetID.text()
 
         # Retrieve files
+        offline = self._ui.checkBoxOffline.isChecked()
+        search_pages = None
         if search_by == "filename":
-            discover_search_files_url = "https://api.pennsieve.io/discover/search/files"
-            headers = {
-                "Content-Type": "application/json",
-                "Accept": "application/json; charset=utf-8",
-            }
-            params = {
-                "limit": 100,
-                "offset": 0,
-                "query": search_text,
-                "datasetId": dataset_id,
-            }
-            response = requests.get(discover_search_files_url, headers=headers, params=params)
-            if response.status_code == 200:
-                json_data = response.json()
-                self._list_files = json_data['files']
+            search_pages = pennsieve_file_search_pages(search_text, dataset_id, offline)
         elif search_by == "mimetype":
             facets = {
                 'species': _extract_facets(self._ui.toolButtonFilterSpecies),
                 'organ': _extract_facets(self._ui.toolButtonFilterOrgan),
             }
 
-            self._list_files = _scicrunch_search(search_text, search_by, facets)
+            search_pages = scicrunch_search_pages(search_text, search_by, facets, offline)
         elif search_by == "DOI":
-            search_text = _standardise_doi_form(search_text)
-            self._list_files = _scicrunch_search(search_text, search_by)
+            search_text = standardise_doi_form(search_text)
+            search_pages = scicrunch_search_pages(search_text, search_by, offline=offline)
         else:
             print("Not handling this type of search yet!")
 
-        # Display the search result in a table view.
-        self._set_table(self._list_files)
-        self._ui.pushButtonSearch.setText("Search")
-        self._ui.pushButtonSearch.setEnabled(True)
+        if search_pages is None:
+            return
+
+        # Supersede any search that is still running.
+        self._stop_search()
+        self._search_cancel_event = threading.Event()
+        self._search_results_shown = False
+        self._ui.labelSearchStatus.clear()
+
+        task = SearchTask(self._search_generation, search_pages, self._search_cancel_event)
+        task.signals.page.connect(self._on_search_page)
+        task.signals.error.connect(self._on_search_error)
+        task.signals.finished.connect(self._on_search_finished)
+        QtCore.QThreadPool.globalInstance().start(task)
+        self._update_ui()
+
+    def _stop_search(self):
+        if self._search_cancel_event is not None:
+            self._search_cancel_event.set()
+            self._search_cancel_event = None
+        # Results still in flight from the stopped search will be discarded.
+        self._search_generation += 1
+
+    def _on_search_page(self, generation, page):
+        if generation != self._search_generation:
+            return
+
+        # Display the search result in a table view, pages of results are added as they arrive.
+        if self._search_results_shown:
+            self._append_to_table(page)
+        else:
+            self._set_table(page)
+            self._search_results_shown = True
+
+        self._update_ui()
+
+    def _on_search_error(self, generation, message):
+        if generation == self._search_generation:
+            # Otherwise the empty result table would look like the search found nothing.
+            self._ui.labelSearchStatus.setText(message)
+
+    def _on_search_finished(self, generation):
+        if generation != self._search_generation:
+            return
+
+        if not self._search_results_shown:
+            self._set_table([])
+            self._search_results_shown = True
+
+        self._search_cancel_event = None
         self._update_ui()
 
-    def _update_completer_model(self, text):
-        word_bank = _word_bank(text)
-        self._search_completer_model = QtCore.QStringListModel(word_bank)
-        self._completer.setModel(self._search_completer_model)
+    def _cancel_search_button_clicked(self):
+        self._stop_search()
+        self._update_ui()
 
     def _search_by_changed(self, text):
         self._update_ui()
-        self._update_completer_model(text)
+        self._search_completer_model.setStringList([])
+
+    def _show_completions(self, completer, completer_model, kind, text):
+        prefix = text.rpartition(',')[-1]
+        completions = self._completion_engine.complete(kind, prefix) if len(prefix) > 1 else []
+        completer_model.setStringList(completions)
+        if completions:
+            completer.setCompletionPrefix(prefix)
+            completer.complete()
+        else:
+            completer.popup().hide()
 
     def _search_text_changed(self, text):
         if not self._completing:
-            found = False
-            prefix = text.rpartition(',')[-1]
-            if len(prefix) > 1:
-                self._completer.setCompletionPrefix(prefix)
-                if self._completer.currentRow() >= 0:
-                    found = True
-            if found:
-                self._completer.complete()
-            else:
-                self._completer.popup().hide()
+            self._show_completions(self._completer, self._search_completer_model,
+                                   self._ui.comboBoxSearchBy.currentText(), text)
             self._update_ui()
 
     def _dataset_id_text_changed(self, text):
         if not self._dataset_id_completing:
-            found = False
-            prefix = text.rpartition(',')[-1]
-            if len(prefix) > 1:
-                self._dataset_id_completer.setCompletionPrefix(prefix)
-                if self._dataset_id_completer.currentRow() >= 0:
-                    found = True
-            if found:
-                self._dataset_id_completer.complete()
-            else:
-                self._dataset_id_completer.popup().hide()
+            self._show_completions(self._dataset_id_completer, self._dataset_id_completer_model, "dataset-id", text)
 
     def _handle_completion(self, text):
         if not self._completing:
@@ -591,78 +545,154 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
     def _save_search(self):
         search_by = self._ui.comboBoxSearchBy.currentText()
         search_text = self._ui.lineEditSearch.text()
-        _save_to_search_bank(search_by, search_text)
+        self._record_search(search_by, search_text)
         dataset_id = self._ui.lineEditDatasetID.text()
         if dataset_id:
-            _save_to_search_bank("dataset-id", dataset_id)
+            self._record_search("dataset-id", dataset_id)
+
+    def _record_search(self, kind, value):
+        _get_search_history().record(kind, value)
+        self._completion_engine.record(kind, value)
 
     def _search_button_clicked(self):
-        self._ui.pushButtonSearch.setText("   ...   ")
-        self._ui.pushButtonSearch.setEnabled(False)
         self._retrieve_data()
         self._save_search()
 
     def _check_and_restore_cache(self):
-        """Scans manifest and provided files list to restore missing items."""
-        manifest = _load_manifest(self._settings_filename)
-        if not manifest:
+        """Scans the manifest in the background and offers to restore missing items as they are found."""
+        manifest = self._manifest.entries()
+        self._pending_downloads = dict(self._manifest.pending_downloads())
+        if not manifest and not self._pending_downloads:
             return
 
-        missing_items = []
-        provided_files = self.get_output_files()
-
-        for rel_path, item_data in manifest.items():
-            full_path = os.path.join(self._output_dir, rel_path)
-
-            # If file is missing or explicitly needed by the provided files list
-            if not os.path.exists(full_path) or (
-                    rel_path in provided_files and not os.path.exists(full_path)
-            ):
-                missing_items.append(item_data)
-
-        if missing_items:
-            missing_count = len(missing_items)
-            singular = missing_count == 1
+        # Interrupted downloads are resumed from their partial files.
+        self._restore_items = [item_data for rel_path, item_data in self._pending_downloads.items()
+                               if rel_path not in manifest]
+        self._restore_reply = None
+        self._scan_cancel_event = threading.Event()
+        # The scan works on a copy, downloads may add to the manifest while it runs.
+        task = IntegrityScanTask(self._output_dir, dict(manifest), self._hash_cache, self._scan_cancel_event)
+        task.signals.problems.connect(self._on_cache_problems)
+        task.signals.finished.connect(self._on_cache_scan_finished)
+        QtCore.QThreadPool.globalInstance().start(task)
+
+        if self._restore_items:
+            self._offer_restore()
+
+    def _on_cache_problems(self, problems):
+        self._restore_items.extend(item_data for _, item_data, _ in problems)
+        if self._restore_reply is None and not self._restore_prompting:
+            self._offer_restore()
+
+    def _on_cache_scan_finished(self):
+        self._scan_cancel_event = None
+        # Problems found after the user chose to restore are restored together.
+        if self._restore_reply:
+            self._restore_found_items()
+
+    def _offer_restore(self):
+        missing_count = len(self._restore_items)
+        singular = missing_count == 1
+        still_scanning = self._scan_cancel_event is not None
+        self._restore_prompting = True
+        try:
             reply = QtWidgets.QMessageBox.question(
                 self,
                 "Restore Missing Cache",
-                f"Could not find {missing_count} provided file{'' if singular else 's'} cached locally."
+                f"Could not find {missing_count} provided file{'' if singular else 's'} cached locally"
+                f"{' so far, the check is still running' if still_scanning else ''}."
                 f" Would you like to restore {'it' if singular else 'them'} now?",
                 QtWidgets.QMessageBox.StandardButton.Yes
                 | QtWidgets.QMessageBox.StandardButton.No,
             )
-            if reply == QtWidgets.QMessageBox.StandardButton.Yes:
-                self._start_download_batch(missing_items)
+        finally:
+            self._restore_prompting = False
+
+        self._restore_reply = reply == QtWidgets.QMessageBox.StandardButton.Yes
+        if self._restore_reply:
+            self._restore_found_items()
+        else:
+            self._restore_items = []
+            if self._scan_cancel_event is not None:
+                self._scan_cancel_event.set()
+
+    def _restore_found_items(self):
+        items_data = self._restore_items
+        self._restore_items = []
+        self._start_download_batch(items_data)
 
     def _start_download_batch(self, items_data):
         if not items_data:
             return
 
-        thread_pool = QtCore.QThreadPool.globalInstance()
-        self._cancel_event = threading.Event()
+        batch = self._download_scheduler.create_batch()
+        cancel_event = batch.cancel_event
 
-        download_dialog = DownloadProgressDialog(len(items_data), self)
+        download_dialog = DownloadProgressDialog(
+            items_data, lambda item: form_local_destination(self._output_dir, item), self)
         download_dialog.show()
-        download_dialog.rejected.connect(self._cancelled_download)
+        # Batches may overlap, each dialog only cancels the downloads it shows.
+        download_dialog.rejected.connect(lambda: self._download_scheduler.cancel(batch))
+        download_dialog.finished.connect(self._hash_cache.save)
+        download_dialog.finished.connect(self._save_pending_downloads)
+        download_dialog.finished.connect(download_dialog.deleteLater)
 
         for item_data in items_data:
-            task = FileDownloadTask(item_data, self._output_dir, self._cancel_event)
+            self._pending_downloads[manifest_key(self._output_dir, item_data)] = item_data
+        self._manifest.set_pending_downloads(dict(self._pending_downloads))
+
+        if self._async_download_engine is not None:
+            # Progress and completion arrive from the event loop thread, the signals queue them to this thread.
+            # They outlive a cancelled dialog, until the downloads that were already running have stopped.
+            signals = DownloadSignals(self)
+            signals.finished.connect(self._on_download_finished)
+            signals.finished.connect(download_dialog.on_file_downloaded)
+            signals.progress.connect(download_dialog.on_file_progress)
+            future = self._async_download_engine.submit(items_data, self._output_dir, cancel_event, self._hash_cache,
+                                                        self._object_store, signals.progress.emit,
+                                                        signals.finished.emit)
+            future.add_done_callback(lambda _: signals.deleteLater())
+            return
+
+        def create_task(unit):
+            if len(unit) == 1:
+                task = FileDownloadTask(unit[0], self._output_dir, cancel_event, self._hash_cache,
+                                        self._metadata_resolver, self._object_store)
+            else:
+                task = ZipBatchDownloadTask(unit, self._output_dir, cancel_event, self._hash_cache,
+                                            self._metadata_resolver, self._object_store)
 
             task.signals.finished.connect(self._on_download_finished)
             task.signals.finished.connect(download_dialog.on_file_downloaded)
             task.signals.progress.connect(download_dialog.on_file_progress)
 
-            thread_pool.start(task)
+            return task
+
+        self._metadata_resolver.prefetch(items_data)
+        self._download_scheduler.submit(batch, group_download_items(items_data), create_task,
+                                        lambda unit: download_host(unit[0]), priority=download_unit_priority)
 
     def _on_download_finished(self, local_destination, item_data_str):
         if local_destination != "error" and os.path.exists(local_destination):
             # Update cache manifest.
             item_data = json.loads(item_data_str)
-            _save_manifest_entry(self._output_dir, item_data, self._settings_filename)
+            path_key = manifest_key(self._output_dir, item_data)
+            self._manifest.add(path_key, item_data)
+            self._pending_downloads.pop(path_key, None)
+            self._file_browser_model.add_file(local_destination, item_data)
 
             # Automatically populate output files list if not present.
             self._populate_output_list(local_destination)
 
+    def _save_pending_downloads(self):
+        # Only downloads that left a partial file behind are worth resuming.
+        self._pending_downloads = {
+            rel_path: item_data for rel_path, item_data in self._pending_downloads.items()
+            if os.path.isfile(partial_filename(os.path.join(self._output_dir, rel_path)))
+        }
+        # Also folds the manifest journal written during the batch into the settings file.
+        self._manifest.set_pending_downloads(dict(self._pending_downloads))
+
     def _populate_output_list(self, local_destination):
         rel_path = os.path.relpath(local_destination, self._output_dir)
         list_model = self._ui.listViewProvidedFiles.model()
@@ -673,30 +703,11 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
             self._update_ui()
 
     def _download_button_clicked(self):
-        indexes = self._ui.tableViewSearchResult.selectionModel().selectedRows()
-        items_to_download = []
-
-        for index in indexes:
-            model_index = index.siblingAtColumn(0)
-            item_data = model_index.data(QtCore.Qt.ItemDataRole.UserRole)
-            if item_data.get('datasetPath') is None:
-                item_data['datasetPath'] = _determine_dataset_path(item_data['uri'])
-            items_to_download.append(item_data)
-
-        self._start_download_batch(items_to_download)
-
-    def _cancelled_download(self):
-        # 1. Signal all currently executing threads to stop streaming.
-        if self._cancel_event is not None:
-            self._cancel_event.set()
-
-        # 2. Clear any tasks waiting in the QThreadPool queue that haven't started yet.
-        QtCore.QThreadPool.globalInstance().clear()
+        self._start_download_batch(self._selected_search_results())
 
     def _export_vtk_button_clicked(self):
-        indexes = self._ui.tableViewSearchResult.selectionModel().selectedRows()
-        for index in indexes:
-            output_name = os.path.join(self._output_dir, self._list_files[index.row()]['name'])
+        for item in self._selected_search_results():
+            output_name = os.path.join(self._output_dir, item['name'])
             print('DISABLED: Exporting ' + output_name)
 
     def get_output_files(self):
@@ -704,29 +715,73 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
         return list_model.stringList()
 
     def _done_button_clicked(self):
-        # Validate all provided files exist before completing step
-        manifest = _load_manifest(self._settings_filename)
-        provided_files = self.get_output_files()
-        missing_required = []
-
-        for rel_path in provided_files:
-            full_path = os.path.join(self._output_dir, rel_path)
-            if not os.path.exists(full_path):
-                if rel_path in manifest:
-                    missing_required.append(manifest[rel_path])
-
-        if missing_required:
+        # Verify the provided files against the checksums recorded when they were downloaded before completing step.
+        manifest = self._manifest.entries()
+        provided_entries = {rel_path: manifest[rel_path] for rel_path in self.get_output_files()
+                            if rel_path in manifest}
+        if not provided_entries:
+            self._complete_step()
+            return
+
+        self._verify_problems = []
+        self._verify_cancel_event = threading.Event()
+        self._verify_dialog = QtWidgets.QProgressDialog("Verifying provided files...", "Cancel", 0,
+                                                        VERIFY_PROGRESS_STEPS, self)
+        self._verify_dialog.setWindowTitle("Verify Files")
+        self._verify_dialog.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
+        self._verify_dialog.canceled.connect(self._verify_cancel_event.set)
+        self._update_ui()
+
+        task = IntegrityScanTask(self._output_dir, provided_entries, self._hash_cache, self._verify_cancel_event,
+                                 verify=True)
+        task.signals.problems.connect(self._on_verify_problems)
+        task.signals.progress.connect(self._on_verify_progress)
+        task.signals.finished.connect(self._on_verify_finished)
+        QtCore.QThreadPool.globalInstance().start(task)
+
+    def _on_verify_problems(self, problems):
+        self._verify_problems.extend(item_data for _, item_data, _ in problems)
+
+    def _on_verify_progress(self, checked, total):
+        if self._verify_dialog is not None and total > 0:
+            self._verify_dialog.setValue(int(VERIFY_PROGRESS_STEPS * checked / total))
+
+    def _on_verify_finished(self):
+        cancelled = self._verify_cancel_event.is_set()
+        self._verify_cancel_event = None
+        # Closing the dialog would report it as cancelled.
+        self._verify_dialog.canceled.disconnect()
+        self._verify_dialog.close()
+        self._verify_dialog.deleteLater()
+        self._verify_dialog = None
+        self._update_ui()
+        # Digests computed while verifying make the next verification of unchanged files a stat call.
+        self._hash_cache.save()
+        if cancelled:
+            return
+
+        failed_items = self._verify_problems
+        self._verify_problems = []
+        if failed_items:
             reply = QtWidgets.QMessageBox.warning(
                 self,
                 "Missing Files",
-                f"{len(missing_required)} required file(s) are missing from disk. Download them before proceeding?",
+                f"{len(failed_items)} required file(s) are missing from disk or failed verification."
+                f" Download them before proceeding?",
                 QtWidgets.QMessageBox.StandardButton.Yes
                 | QtWidgets.QMessageBox.StandardButton.No,
             )
             if reply == QtWidgets.QMessageBox.StandardButton.Yes:
-                self._start_download_batch(missing_required)
+                self._start_download_batch(failed_items)
                 return
 
+        self._complete_step()
+
+    def _complete_step(self):
+        if self._async_download_engine is not None:
+            # Started again should the step need to download more.
+            self._async_download_engine.close()
+        self._manifest.flush()
         self._callback()
 
     def register_done_execution(self, callback):
@@ -734,38 +789,3 @@ class RetrievePortalDataWidget(QtWidgets.QWidget):
 
     def set_identifier(self, identifier):
         self._ui.manifestGroupBox.setTitle(f"Identifier: {identifier}")
-
-
-def _form_local_destination(base_dir, info):
-    near_relative_local_path = info['datasetPath'].replace('files/', '')
-    return os.path.join(base_dir, str(info['datasetId']), str(info['datasetVersion']), near_relative_local_path)
-
-
-def _load_manifest(manifest_path):
-    if os.path.exists(manifest_path):
-        try:
-            with open(manifest_path, 'r') as f:
-                return json.load(f).get('manifest', {})
-        except (json.JSONDecodeError, OSError):
-            return {}
-    return {}
-
-
-def _save_manifest_entry(output_dir, item_data, manifest_path):
-    manifest = _load_manifest(manifest_path)
-    local_dest = _form_local_destination(output_dir, item_data)
-    rel_path = os.path.relpath(local_dest, output_dir)
-    path_key = pathlib.PureWindowsPath(rel_path).as_posix()
-    # Save metadata indexed by relative file path.
-    manifest[path_key] = item_data
-
-    safe_makedirs(output_dir)
-    try:
-        with open(manifest_path) as f:
-            all_content = json.load(f)
-        all_content.update({'manifest': manifest})
-        with open(manifest_path, 'w') as f:
-            json.dump(all_content, f, indent=2)
-    except OSError as e:
-        print(f"Error updating download manifest: {e}")
-
@@ -1,5 +1,7 @@
 from urllib.parse import quote_plus
 
+from mapclientplugins.retrieveportaldatastep.jsonstream import StreamedArray
+
 
 def _get_facet_type_map():
     return {
@@ -70,21 +72,57 @@ def _facet_query_string(query, facets, type_map):
     return qt
 
 
-def create_filter_request(query, facets, size, start, fields=None):
+# Sort order used to page through results with search_after, the dataset id breaks ties
+# between hits with equal scores.  Sorting on _id is deprecated and may be disabled.
+PAGING_SORT = [{"_score": "desc"}, {"object_id": "asc"}]
+
+
+def _apply_paging(data, size, start, search_after):
+    data["size"] = size
+    data["sort"] = PAGING_SORT
+    if search_after is None:
+        data["from"] = start
+    else:
+        # Elasticsearch requires 'from' to be zero when paging with search_after.
+        data["from"] = 0
+        data["search_after"] = search_after
+
+    return data
+
+
+# Fields of a dataset and of its file objects needed to describe a search result.
+DATASET_SOURCE_FIELDS = [
+    "object_id",
+    "pennsieve.version.identifier",
+]
+OBJECT_SOURCE_FIELDS = [
+    "objects.name",
+    "objects.mimetype.name",
+    "objects.additional_mimetype.name",
+    "objects.dataset.path",
+    "objects.bytes.count",
+]
+# Elasticsearch limits inner hits to a window (from + size) of 100 by default, so every
+# page of objects starts at zero and continues after the path of the last object received.
+OBJECTS_PAGE_SIZE = 100
+OBJECT_PATH_FIELD = "objects.dataset.path"
+OBJECTS_SORT = [{OBJECT_PATH_FIELD: "asc"}]
+
+
+def create_filter_request(query, facets, size, start, fields=None, search_after=None, source_fields=None):
     if size is None:
         size = 10
     if start is None:
         start = 0
 
     if not query and not facets:
-        return {"size": size, "from": start}
+        data = {"_source": source_fields} if source_fields else {}
+        return _apply_paging(data, size, start, search_after)
 
     query = quote_plus(query)
 
     # Data structure of a sci-crunch search
     data = {
-        "size": size,
-        "from": start,
         "query": {
             "query_string": {
                 "query": ""
@@ -93,16 +131,16 @@ def create_filter_request(query, facets, size, start, fields=None):
     }
     if fields:
         data["query"]["query_string"]["fields"] = fields
+    if source_fields:
+        data["_source"] = source_fields
 
     qs = _facet_query_string(query, facets, _get_facet_type_map())
     data["query"]["query_string"]["query"] = qs
-    return data
+    return _apply_paging(data, size, start, search_after)
 
 
-def form_scicrunch_match_request(match_field, match_value, source_fields, size=20, start=0):
-    return {
-        "size": size,
-        "from": start,
+def form_scicrunch_match_request(match_field, match_value, source_fields, size=20, start=0, search_after=None):
+    data = {
         "query": {
             "match": {
                 match_field: f"DOI:{match_value}"
@@ -110,3 +148,171 @@ def form_scicrunch_match_request(match_field, match_value, source_fields, size=2
         },
         "_source": source_fields
     }
+    return _apply_paging(data, size, start, search_after)
+
+
+def facets_query(facets):
+    qs = _facet_query_string("", facets or {}, _get_facet_type_map())
+    return {"query_string": {"query": qs}} if qs else None
+
+
+def doi_query(match_field, match_value):
+    return {"match": {match_field: f"DOI:{match_value}"}}
+
+
+def dataset_id_query(dataset_id):
+    return {"term": {"object_id": dataset_id}}
+
+
+def object_match_query(match_field=None, match_value=None):
+    """
+    Query selecting the file objects of a dataset, directories are never selected.
+    If match_field is given the objects must also have match_value in that field.
+    """
+    query = {
+        "bool": {
+            "must_not": [{"match_phrase": {"objects.mimetype.name": "inode/directory"}}]
+        }
+    }
+    if match_field:
+        query["bool"]["must"] = [{"match_phrase": {match_field: match_value}}]
+
+    return query
+
+
+def objects_after_query(object_query, path):
+    """
+    Restrict an object query to the objects following path in the order of OBJECTS_SORT.
+    """
+    return {
+        "bool": {
+            "must": [object_query],
+            "filter": [{"range": {OBJECT_PATH_FIELD: {"gt": path}}}],
+        }
+    }
+
+
+def form_nested_object_request(dataset_query, object_query, size, start, search_after=None,
+                               objects_size=OBJECTS_PAGE_SIZE):
+    """
+    Request for datasets with matching file objects, the objects themselves are selected by
+    Elasticsearch and returned as inner hits so that only the matching objects are sent back.
+    """
+    must = [{
+        "nested": {
+            "path": "objects",
+            "query": object_query,
+            "inner_hits": {
+                "size": objects_size,
+                "from": 0,
+                "sort": OBJECTS_SORT,
+                "_source": OBJECT_SOURCE_FIELDS,
+            },
+        }
+    }]
+    if dataset_query:
+        must.append(dataset_query)
+
+    data = {
+        "query": {
+            "bool": {
+                "must": must
+            }
+        },
+        "_source": DATASET_SOURCE_FIELDS,
+    }
+    return _apply_paging(data, size, start, search_after)
+
+
+def form_dataset_objects_request(dataset_id):
+    """
+    Request for all the file objects of a single dataset.
+    """
+    data = {
+        "query": dataset_id_query(dataset_id),
+        "_source": DATASET_SOURCE_FIELDS + OBJECT_SOURCE_FIELDS,
+    }
+    return _apply_paging(data, 1, 0, None)
+
+
+def result_window_exceeded(error_text):
+    """
+    Return True if an Elasticsearch error reports that a request went past the (inner) result window.
+    """
+    return "result window is too large" in error_text.lower()
+
+
+def inner_object_hits(result):
+    """
+    Return the objects of an inner hits result, and the total number of matching objects.
+    """
+    hits = result.get("inner_hits", {}).get("objects", {}).get("hits", {})
+    return [hit["_source"] for hit in hits.get("hits", [])], _total_hits(hits)
+
+
+def _total_hits(hits):
+    total = hits.get("total", 0)
+    # Newer Elasticsearch versions report the total as an object.
+    if isinstance(total, dict):
+        return total.get("value", 0)
+
+    return total
+
+
+def _hit_batches(post_result, batch_size):
+    if not isinstance(post_result, StreamedArray):
+        page = post_result.get("hits", {}).get("hits", [])
+        if page:
+            yield page
+        return
+
+    batch = []
+    for hit in post_result:
+        batch.append(hit)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def _response_total(post_result):
+    document = post_result.document if isinstance(post_result, StreamedArray) else post_result
+    return _total_hits(document.get("hits", {}))
+
+
+def iterate_result_pages(form_request, do_request, page_size, batch_size=None):
+    """
+    Generator yielding the hits of a search until the results are exhausted.
+    The first pages are fetched with from/size, subsequent pages continue from the sort
+    values of the last hit received (search_after) so that paging is not limited by the
+    result window of the index.
+    A decoded response is yielded a page at a time, a streamed response is yielded in
+    batches of hits as they arrive.
+
+    :param form_request: Callable taking (size, start, search_after) returning a request body.
+    :param do_request: Callable taking a request body returning the decoded response,
+        or a StreamedArray over the hits of the response.
+    :param page_size: Number of hits to request per page.
+    :param batch_size: Number of streamed hits per batch, defaults to page_size.
+    """
+    start = 0
+    search_after = None
+    while True:
+        post_result = do_request(form_request(page_size, start, search_after))
+        received = 0
+        last_hit = None
+        for batch in _hit_batches(post_result, batch_size or page_size):
+            received += len(batch)
+            last_hit = batch[-1]
+            yield batch
+
+        if not received:
+            return
+
+        start += received
+        if received < page_size or start >= _response_total(post_result):
+            return
+
+        search_after = last_hit.get("sort")
@@ -0,0 +1,160 @@
+"""
+Two tier cache for search responses.
+
+Responses are kept in an in-memory LRU and in a directory on disk, keyed by a
+digest of the canonicalised request.  Entries expire after a time to live,
+the disk tier is trimmed to a maximum size by evicting the least recently
+written entries.  In offline mode, or when the network is unavailable,
+expired entries are served rather than nothing at all.
+"""
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+DEFAULT_TTL = 12 * 60 * 60
+DEFAULT_MEMORY_ENTRIES = 64
+DEFAULT_MAX_DISK_BYTES = 200 * 1024 * 1024
+
+
+class OfflineCacheMiss(Exception):
+    pass
+
+
+def request_key(url, params=None, body=None):
+    """
+    Digest identifying a request, independent of the order of keys in params and body.
+    """
+    canonical = json.dumps({'url': url, 'params': params or {}, 'body': body or {}}, sort_keys=True,
+                           separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class SearchCache(object):
+
+    def __init__(self, cache_dir, ttl=DEFAULT_TTL, memory_entries=DEFAULT_MEMORY_ENTRIES,
+                 max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        self._cache_dir = cache_dir
+        self._ttl = ttl
+        self._memory_entries = memory_entries
+        self._max_disk_bytes = max_disk_bytes
+        self._lock = threading.Lock()
+        self._memory = collections.OrderedDict()
+        self._disk_bytes = None
+
+    def _entry_filename(self, key):
+        return os.path.join(self._cache_dir, f"{key}.json")
+
+    def _remember(self, key, stored_at, value):
+        with self._lock:
+            self._memory[key] = (stored_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self._memory_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+
+        try:
+            with open(self._entry_filename(key)) as f:
+                entry = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return None
+
+        self._remember(key, entry['stored-at'], entry['value'])
+        return entry['stored-at'], entry['value']
+
+    def get(self, key, allow_stale=False):
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+
+        stored_at, value = entry
+        if not allow_stale and time.time() - stored_at > self._ttl:
+            return None
+
+        return value
+
+    def put(self, key, value):
+        stored_at = time.time()
+        self._remember(key, stored_at, value)
+        try:
+            os.makedirs(self._cache_dir, exist_ok=True)
+            entry_filename = self._entry_filename(key)
+            temporary_filename = f"{entry_filename}.{threading.get_ident()}.tmp"
+            with open(temporary_filename, 'w') as f:
+                json.dump({'stored-at': stored_at, 'value': value}, f)
+            os.replace(temporary_filename, entry_filename)
+            self._account(os.path.getsize(entry_filename))
+        except OSError as e:
+            print(f"Error writing search cache: {e}")
+
+    def _account(self, size):
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self._cache_dir) if entry.is_file())
+            else:
+                self._disk_bytes += size
+
+            if self._disk_bytes > self._max_disk_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted((entry for entry in os.scandir(self._cache_dir) if entry.is_file()),
+                         key=lambda entry: entry.stat().st_mtime)
+        total = sum(entry.stat().st_size for entry in entries)
+        # Trim to three quarters of the limit so that eviction is not needed on every write.
+        target = self._max_disk_bytes * 3 // 4
+        for entry in entries:
+            if total <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                pass
+
+        self._disk_bytes = total
+
+    def fetch(self, key, fetch, offline=False, store=True):
+        """
+        Return the cached value for key, calling fetch to retrieve it when it is not cached or has expired.
+        A fetch returning None is not cached.
+
+        :param key: Key of the request, see request_key.
+        :param fetch: Callable performing the request and returning the decoded value.
+        :param offline: If True never call fetch, serving expired entries instead.
+        :param store: If False the fetched value is not cached, for values that are still
+            being received the caller puts the value once it is complete.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        if offline:
+            value = self.get(key, allow_stale=True)
+            if value is None:
+                raise OfflineCacheMiss("Search is not available offline.")
+            return value
+
+        try:
+            value = fetch()
+        except (requests.ConnectionError, requests.Timeout):
+            value = self.get(key, allow_stale=True)
+            if value is None:
+                raise
+            return value
+
+        if store and value is not None:
+            self.put(key, value)
+
+        return value
@@ -0,0 +1,112 @@
+"""
+Search history kept in a small SQLite database.
+
+Every search value is recorded once per kind of search with how often and
+when it was last used, completions are ranked on both.  The history for each
+kind is capped, the lowest ranked values are evicted first.  SQLite's locking
+lets several MAP Client instances record searches at the same time.
+"""
+import contextlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SEARCH_HISTORY_FILENAME = "retrieveportaldata-search-history.sqlite"
+DEFAULT_MAX_ENTRIES = 1000
+# Seconds to wait for another instance to finish writing.
+BUSY_TIMEOUT = 10
+# Frequency weighted by recency, a use counts half as much after a week.
+RANK_HALF_LIFE = 7 * 24 * 60 * 60
+_RANK = f"count / (1.0 + (? - last_used) / {RANK_HALF_LIFE}.0)"
+
+
+def rank(count, last_used, now):
+    """
+    Rank of a value, the same ranking the history orders its values by.
+    """
+    return count / (1.0 + (now - last_used) / RANK_HALF_LIFE)
+
+
+class SearchHistory(object):
+
+    def __init__(self, filename, max_entries=DEFAULT_MAX_ENTRIES):
+        self._filename = filename
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._initialise()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # A connection per operation, committed on success and always closed.
+        connection = sqlite3.connect(self._filename, timeout=BUSY_TIMEOUT)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _initialise(self):
+        with self._lock, self._connect() as connection:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "kind TEXT NOT NULL, value TEXT NOT NULL, count INTEGER NOT NULL, last_used REAL NOT NULL, "
+                "PRIMARY KEY (kind, value))")
+            # Histories written by earlier versions kept a full text index, completion no longer uses it.
+            connection.execute("DROP TRIGGER IF EXISTS history_insert")
+            connection.execute("DROP TRIGGER IF EXISTS history_delete")
+            try:
+                connection.execute("DROP TABLE IF EXISTS history_index")
+            except sqlite3.OperationalError:
+                # The index cannot be dropped by an SQLite built without FTS5, without its triggers it is unused.
+                pass
+
+    def import_search_bank(self, search_bank_filename):
+        """
+        Record the values of a JSON search bank, from earlier versions, when the history is empty.
+        """
+        if not os.path.isfile(search_bank_filename):
+            return
+
+        try:
+            with open(search_bank_filename) as f:
+                search_bank = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return
+
+        with self._lock, self._connect() as connection:
+            if connection.execute("SELECT COUNT(*) FROM history").fetchone()[0]:
+                return
+
+            now = time.time()
+            rows = []
+            for kind, values in search_bank.items():
+                # Later entries of the bank were added more recently.
+                rows.extend((kind, value, now - len(values) + position)
+                            for position, value in enumerate(values) if value)
+            connection.executemany(
+                "INSERT OR IGNORE INTO history (kind, value, count, last_used) VALUES (?, ?, 1, ?)", rows)
+
+    def record(self, kind, value):
+        if not value:
+            return
+
+        now = time.time()
+        with self._lock, self._connect() as connection:
+            connection.execute(
+                "INSERT INTO history (kind, value, count, last_used) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (kind, value) DO UPDATE SET count = count + 1, last_used = excluded.last_used",
+                (kind, value, now))
+            connection.execute(
+                "DELETE FROM history WHERE kind = ? AND rowid NOT IN ("
+                f"SELECT rowid FROM history WHERE kind = ? ORDER BY {_RANK} DESC LIMIT ?)",
+                (kind, kind, now, self._max_entries))
+
+    def usage(self):
+        """
+        Return (kind, value, count, last_used) for every recorded value.
+        """
+        with self._lock, self._connect() as connection:
+            return connection.execute("SELECT kind, value, count, last_used FROM history").fetchall()
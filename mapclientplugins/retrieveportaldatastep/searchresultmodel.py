@@ -0,0 +1,133 @@
+"""
+Table model for search results.
+
+Results are held column by column rather than as a dict, or a row of items,
+per result.  Dataset ids, versions and mimetypes repeat across many rows and
+are interned so every row refers to the same object.  Rows are handed to the
+view in batches as it asks for more, so a large result set is not laid out
+all at once.
+"""
+from array import array
+
+from PySide6 import QtCore
+
+from mapclientplugins.retrieveportaldatastep.engine import determine_dataset_path
+
+COLUMN_HEADERS = ['Filename', 'Dataset ID', 'Dataset Version', 'Mimetype', 'Dataset Path']
+FILENAME_COLUMN = 0
+DATASET_ID_COLUMN = 1
+DATASET_VERSION_COLUMN = 2
+MIMETYPE_COLUMN = 3
+DATASET_PATH_COLUMN = 4
+FETCH_BATCH_SIZE = 1000
+_UNKNOWN_SIZE = -1
+
+
+class SearchResultModel(QtCore.QAbstractTableModel):
+
+    def __init__(self, parent=None, fetch_batch_size=FETCH_BATCH_SIZE):
+        super().__init__(parent)
+        self._fetch_batch_size = fetch_batch_size
+        self._fetched = 0
+        self._interned = {}
+        self._columns = [[] for _ in COLUMN_HEADERS]
+        self._sizes = array('q')
+
+    def _intern(self, value):
+        return self._interned.setdefault(value, value)
+
+    def clear(self):
+        self.beginResetModel()
+        self._fetched = 0
+        self._interned = {}
+        self._columns = [[] for _ in COLUMN_HEADERS]
+        self._sizes = array('q')
+        self.endResetModel()
+
+    def append(self, results):
+        """
+        Add search results, the new rows become visible as the view fetches them.
+        """
+        names, dataset_ids, dataset_versions, mimetypes, dataset_paths = self._columns
+        for file_info in results:
+            names.append(file_info['name'])
+            dataset_ids.append(self._intern(file_info['datasetId']))
+            dataset_versions.append(self._intern(file_info['datasetVersion']))
+            mimetypes.append(self._intern(file_info.get('mimetype', file_info.get('fileType', ''))))
+            dataset_path = file_info.get('datasetPath')
+            if dataset_path is None:
+                dataset_path = determine_dataset_path(file_info.get('uri'))
+            dataset_paths.append(dataset_path)
+            size = file_info.get('size')
+            self._sizes.append(_UNKNOWN_SIZE if size is None else size)
+
+        # The first batch is shown straight away, the view asks for the rest as it is scrolled.
+        count = min(self._fetch_batch_size, self.result_count()) - self._fetched
+        if count > 0:
+            self._insert_fetched(count)
+
+    def result_count(self):
+        """
+        Number of results held, including those not yet fetched by the view.
+        """
+        return len(self._sizes)
+
+    def column_values(self, column):
+        return self._columns[column]
+
+    def item(self, row):
+        """
+        Return the result at row in the form used by the download tasks.
+        """
+        names, dataset_ids, dataset_versions, mimetypes, dataset_paths = self._columns
+        size = self._sizes[row]
+        return {
+            'name': names[row],
+            'datasetId': dataset_ids[row],
+            'datasetVersion': dataset_versions[row],
+            'mimetype': mimetypes[row],
+            'datasetPath': dataset_paths[row],
+            'size': None if size == _UNKNOWN_SIZE else size,
+        }
+
+    def fetch_all(self):
+        if self.canFetchMore(QtCore.QModelIndex()):
+            self._insert_fetched(self.result_count() - self._fetched)
+
+    def _insert_fetched(self, count):
+        self.beginInsertRows(QtCore.QModelIndex(), self._fetched, self._fetched + count - 1)
+        self._fetched += count
+        self.endInsertRows()
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self._fetched < self.result_count()
+
+    def fetchMore(self, parent):
+        count = min(self._fetch_batch_size, self.result_count() - self._fetched)
+        if parent.isValid() or count <= 0:
+            return
+
+        self._insert_fetched(count)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else self._fetched
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMN_HEADERS)
+
+    def data(self, index, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if role == QtCore.Qt.ItemDataRole.DisplayRole:
+            return f"{self._columns[index.column()][index.row()]}"
+        if role == QtCore.Qt.ItemDataRole.UserRole:
+            return self.item(index.row())
+
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.ItemDataRole.DisplayRole):
+        if orientation == QtCore.Qt.Orientation.Horizontal and role == QtCore.Qt.ItemDataRole.DisplayRole:
+            return COLUMN_HEADERS[section]
+
+        return super().headerData(section, orientation, role)
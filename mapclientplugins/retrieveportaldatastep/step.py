@@ -4,13 +4,16 @@ MAP Client Plugin Step
 """
 import json
 import os
-import pathlib
 
 from PySide6 import QtGui, QtWidgets, QtCore
 
 from mapclient.mountpoints.workflowstep import WorkflowStepMountPoint
-from mapclientplugins.retrieveportaldatastep.configuredialog import ConfigureDialog
-from mapclientplugins.retrieveportaldatastep.retrieveportaldatawidget import RetrievePortalDataWidget
+from mapclientplugins.retrieveportaldatastep.manifest import manifest_journal_filename
+from mapclientplugins.retrieveportaldatastep.stepsettings import StepSettings, default_config, output_directory, \
+    config_valid, SOURCE_FILESYSTEM
+
+# MAP Client imports every plugin when it starts, the dialogs, the widget and the HTTP
+# stack behind it are only imported once the step is configured or executed.
 
 
 class RetrievePortalDataStep(WorkflowStepMountPoint):
@@ -30,11 +33,12 @@ class RetrievePortalDataStep(WorkflowStepMountPoint):
         # Port data:
         self._portData0 = None  # http://physiomeproject.org/workflow/1.0/rdf-schema#directory_location
         # Config:
-        self._config = {
-            'identifier': '', 'output-directories': [], 'output-directory-index': 0,
-        }
+        self._config = default_config()
+        self._settings = None
 
     def _setup_configure_dialog(self, parent=None):
+        from mapclientplugins.retrieveportaldatastep.configuredialog import ConfigureDialog
+
         d = ConfigureDialog(parent)
         d.setWorkflowLocation(self._location)
         d.identifierOccursCount = self._identifierOccursCount
@@ -42,38 +46,44 @@ class RetrievePortalDataStep(WorkflowStepMountPoint):
         return d
 
     def _determine_output_dir(self):
-        d = self._setup_configure_dialog()
-        return d.get_output_directory()
+        return output_directory(self._config, self._location)
 
     def _settings_filename(self):
         return os.path.join(self._location, f"{self._config['identifier']}-settings.json")
 
-    def _get_output_files(self):
-        if not os.path.isfile(self._settings_filename()):
-            with open(self._settings_filename(), "w") as fh:
-                json.dump({}, fh)
+    def _step_settings(self):
+        # The identifier names the settings file, it changes when the step is configured.
+        settings_filename = self._settings_filename()
+        if self._settings is None or self._settings.filename() != settings_filename:
+            self._settings = StepSettings(settings_filename)
 
-        with open(self._settings_filename()) as fh:
-            settings = json.load(fh)
+        return self._settings
 
-        return [f for f in settings.get("output-files", []) if os.path.isfile(os.path.join(self._determine_output_dir(), f))]
+    def _get_output_files(self):
+        settings = self._step_settings()
+        settings.ensure_exists()
+        output_dir = self._determine_output_dir()
+        return [f for f in settings.output_files() if os.path.isfile(os.path.join(output_dir, f))]
 
     def _set_output_files(self, output_files):
-        with open(self._settings_filename()) as fh:
-            settings = json.load(fh)
-
-        settings['output-files'] = [pathlib.PureWindowsPath(f).as_posix() for f in output_files]
-
-        with open(self._settings_filename(), "w") as fh:
-            json.dump(settings, fh)
+        self._step_settings().set_output_files(output_files)
 
     def execute(self):
         QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.CursorShape.WaitCursor)
         try:
+            from mapclientplugins.retrieveportaldatastep.retrieveportaldatawidget import RetrievePortalDataWidget
+
             output_dir = self._determine_output_dir()
             output_files = self._get_output_files()
             settings_filename = self._settings_filename()
-            self._view = RetrievePortalDataWidget(output_dir, output_files, settings_filename)
+            self._view = RetrievePortalDataWidget(output_dir, output_files, settings_filename,
+                                                  max_concurrent_downloads=self._config['max-concurrent-downloads'],
+                                                  max_downloads_per_host=self._config['max-downloads-per-host'],
+                                                  asyncio_downloads=self._config.get('asyncio-downloads', False),
+                                                  max_async_downloads=self._config['max-async-downloads'],
+                                                  max_async_downloads_per_host=self._config[
+                                                      'max-async-downloads-per-host'],
+                                                  file_browser_source=self._config.get('file-browser-source', SOURCE_FILESYSTEM))
             self._view.set_identifier(self._config['identifier'])
             self._view.register_done_execution(self._done_execution)
             self._setCurrentWidget(self._view)
@@ -129,8 +139,13 @@ class RetrievePortalDataStep(WorkflowStepMountPoint):
         """
         self._config.update(json.loads(string))
 
-        d = self._setup_configure_dialog()
-        self._configured = d.validate()
+        self._configured = config_valid(self._config, self._location, self._identifierOccursCount)
 
     def getAdditionalConfigFiles(self):
-        return [self._settings_filename()]
+        config_files = [self._settings_filename()]
+        # Manifest entries not yet folded into the settings file.
+        journal_filename = manifest_journal_filename(self._settings_filename())
+        if os.path.isfile(journal_filename):
+            config_files.append(journal_filename)
+
+        return config_files
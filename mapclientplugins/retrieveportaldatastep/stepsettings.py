@@ -0,0 +1,136 @@
+"""
+Step configuration and settings file without any GUI.
+
+The output directory is resolved from the step configuration the same way the
+configure dialog presents it, so looking it up does not create any widgets.
+The settings file is parsed once and kept in memory, changes are written
+straight through to it.  The download manifest is written to the same file, so
+the file is read again whenever it has changed on disk.  The configuration
+defaults live here too, so the step does not import the Qt models and dialogs
+that use them when MAP Client starts.
+"""
+import os
+import pathlib
+
+from mapclientplugins.retrieveportaldatastep.manifest import load_settings, write_settings
+
+from mapclient.settings.general import get_data_directory
+
+DEFAULT_MAX_CONCURRENT_DOWNLOADS = 8
+DEFAULT_MAX_DOWNLOADS_PER_HOST = 8
+# The event loop downloads do not need a thread per transfer, their limits are set separately and go much higher.
+DEFAULT_MAX_ASYNC_DOWNLOADS = 256
+DEFAULT_MAX_ASYNC_DOWNLOADS_PER_HOST = 256
+MAX_ASYNC_DOWNLOADS = 1024
+# Where the file browser lists the downloaded files from.
+SOURCE_FILESYSTEM = 'filesystem'
+SOURCE_MANIFEST = 'manifest'
+
+
+def default_config():
+    return {
+        'identifier': '', 'output-directories': [], 'output-directory-index': 0,
+        'max-concurrent-downloads': DEFAULT_MAX_CONCURRENT_DOWNLOADS,
+        'max-downloads-per-host': DEFAULT_MAX_DOWNLOADS_PER_HOST,
+        'max-async-downloads': DEFAULT_MAX_ASYNC_DOWNLOADS,
+        'max-async-downloads-per-host': DEFAULT_MAX_ASYNC_DOWNLOADS_PER_HOST,
+        'asyncio-downloads': False, 'file-browser-source': SOURCE_FILESYSTEM,
+    }
+
+
+def local_output_directory(identifier):
+    return f'{identifier}-downloads'
+
+
+def global_output_directory():
+    return os.path.join(get_data_directory(), 'retrieveportaldata-downloads')
+
+
+def output_directory_choices(config):
+    """
+    Output directories in the order of the configure dialog combo box.
+    """
+    return [local_output_directory(config['identifier']), global_output_directory()] + \
+        list(config.get('output-directories', []))
+
+
+def output_directory_location(config):
+    choices = output_directory_choices(config)
+    index = config.get('output-directory-index', 0)
+    return choices[index] if 0 <= index < len(choices) else ''
+
+
+def resolve_output_directory(location, workflow_location):
+    if workflow_location:
+        return os.path.realpath(os.path.join(workflow_location, location))
+
+    return location
+
+
+def output_directory(config, workflow_location):
+    return resolve_output_directory(output_directory_location(config), workflow_location)
+
+
+def output_directory_valid(location, workflow_location):
+    return bool(location) and not os.path.isfile(resolve_output_directory(location, workflow_location))
+
+
+def config_valid(config, workflow_location, identifier_occurs_count):
+    """
+    Validate a configuration as the configure dialog does, an identifier may occur once, for this step.
+    """
+    identifier_valid = identifier_occurs_count(config['identifier']) <= 1
+    return identifier_valid and output_directory_valid(output_directory_location(config), workflow_location)
+
+
+def _file_identity(settings_filename):
+    try:
+        stat_result = os.stat(settings_filename)
+    except OSError:
+        return None
+
+    return stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino
+
+
+class StepSettings(object):
+    """
+    Settings file of a step kept in memory, with write-through persistence.
+    """
+
+    def __init__(self, settings_filename):
+        self._settings_filename = settings_filename
+        self._settings = None
+        self._identity = None
+
+    def filename(self):
+        return self._settings_filename
+
+    def _current(self):
+        identity = _file_identity(self._settings_filename)
+        if self._settings is None or identity != self._identity:
+            self._settings = load_settings(self._settings_filename)
+            self._identity = identity
+
+        return self._settings
+
+    def _write(self):
+        write_settings(self._settings_filename, self._settings)
+        self._identity = _file_identity(self._settings_filename)
+
+    def ensure_exists(self):
+        if not os.path.isfile(self._settings_filename):
+            self._settings = {}
+            self._write()
+
+    def get(self, key, default=None):
+        return self._current().get(key, default)
+
+    def set(self, key, value):
+        self._current()[key] = value
+        self._write()
+
+    def output_files(self):
+        return self.get('output-files', [])
+
+    def set_output_files(self, output_files):
+        self.set('output-files', [pathlib.PureWindowsPath(f).as_posix() for f in output_files])
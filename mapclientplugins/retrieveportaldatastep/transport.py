@@ -0,0 +1,126 @@
+"""
+Pooled HTTP transport shared by the search and download code paths.
+
+A single keep-alive session is used for all requests so that the TCP and TLS
+handshakes for SciCrunch and Pennsieve are paid once per pooled connection
+rather than once per request.
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 8
+# Hosts we talk to: SciCrunch for searching, Pennsieve for file searching, metadata and downloads.
+KNOWN_HOSTS = [
+    "https://scicrunch.org",
+    "https://api.pennsieve.io",
+]
+
+_session = None
+_pool_size = DEFAULT_POOL_SIZE
+_session_lock = threading.Lock()
+
+
+def _create_adapter(pool_size):
+    # One pool per host, each pool holding as many connections as we have concurrent downloads.
+    return HTTPAdapter(pool_connections=len(KNOWN_HOSTS), pool_maxsize=pool_size)
+
+
+def _mount_adapters(session, pool_size):
+    session.mount("https://", _create_adapter(pool_size))
+    session.mount("http://", _create_adapter(pool_size))
+
+
+def get_session():
+    """
+    Return the shared session, creating it on first use.
+    The session can be used concurrently from worker threads, the underlying
+    connection pools are thread-safe.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _mount_adapters(_session, _pool_size)
+
+        return _session
+
+
+def set_pool_size(pool_size):
+    """
+    Set the maximum number of pooled connections kept per host.
+    Should match the number of downloads that may be in flight at once.
+    """
+    global _pool_size
+    pool_size = max(1, int(pool_size))
+    with _session_lock:
+        if pool_size == _pool_size:
+            return
+
+        _pool_size = pool_size
+        if _session is not None:
+            replaced_adapters = list(_session.adapters.values())
+            _mount_adapters(_session, _pool_size)
+            # Release the connections pooled by the replaced adapters now rather than when they are collected.
+            for adapter in replaced_adapters:
+                adapter.close()
+
+
+def get(url, **kwargs):
+    return get_session().get(url, **kwargs)
+
+
+def post(url, **kwargs):
+    return get_session().post(url, **kwargs)
+
+
+def _pools():
+    session = get_session()
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                yield pool
+
+
+def pool_statistics():
+    """
+    Return counters describing how well the connection pools are being reused.
+    A hit is a request served over an already open connection, a miss is a
+    request that had to open a new connection.
+    """
+    requests_made = 0
+    connections_made = 0
+    for pool in _pools():
+        requests_made += pool.num_requests
+        connections_made += pool.num_connections
+
+    return {
+        "requests": requests_made,
+        "hits": max(0, requests_made - connections_made),
+        "misses": connections_made,
+    }
+
+
+def _warm_up_host(url, timeout):
+    try:
+        get_session().head(url, timeout=timeout)
+    except requests.RequestException:
+        # Warming up is opportunistic, the real request will report any problems.
+        pass
+
+
+def warm_up(urls=None, timeout=5):
+    """
+    Open connections to the known hosts in the background so that the first
+    search or download does not pay for the handshake.
+    """
+    for url in KNOWN_HOSTS if urls is None else urls:
+        thread = threading.Thread(target=_warm_up_host, args=(url, timeout), daemon=True)
+        thread.start()
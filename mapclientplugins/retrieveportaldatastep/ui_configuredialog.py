@@ -15,10 +15,10 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QFont, QFontDatabase, QGradient, QIcon,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QAbstractButton, QApplication, QComboBox, QDialog,
-    QDialogButtonBox, QFormLayout, QGridLayout, QGroupBox,
-    QHBoxLayout, QLabel, QLineEdit, QPushButton,
-    QSizePolicy, QWidget)
+from PySide6.QtWidgets import (QAbstractButton, QApplication, QCheckBox, QComboBox,
+    QDialog, QDialogButtonBox, QFormLayout, QGridLayout,
+    QGroupBox, QHBoxLayout, QLabel, QLineEdit,
+    QPushButton, QSizePolicy, QSpinBox, QWidget)
 
 class Ui_ConfigureDialog(object):
     def setupUi(self, ConfigureDialog):
@@ -62,6 +62,54 @@ class Ui_ConfigureDialog(object):
 
         self.formLayout.setLayout(1, QFormLayout.FieldRole, self.horizontalLayout)
 
+        self.label2 = QLabel(self.configGroupBox)
+        self.label2.setObjectName(u"label2")
+
+        self.formLayout.setWidget(2, QFormLayout.LabelRole, self.label2)
+
+        self.spinBoxConcurrentDownloads = QSpinBox(self.configGroupBox)
+        self.spinBoxConcurrentDownloads.setObjectName(u"spinBoxConcurrentDownloads")
+        self.spinBoxConcurrentDownloads.setMinimum(1)
+        self.spinBoxConcurrentDownloads.setMaximum(64)
+        self.spinBoxConcurrentDownloads.setValue(8)
+
+        self.formLayout.setWidget(2, QFormLayout.FieldRole, self.spinBoxConcurrentDownloads)
+
+        self.label3 = QLabel(self.configGroupBox)
+        self.label3.setObjectName(u"label3")
+
+        self.formLayout.setWidget(3, QFormLayout.LabelRole, self.label3)
+
+        self.spinBoxDownloadsPerHost = QSpinBox(self.configGroupBox)
+        self.spinBoxDownloadsPerHost.setObjectName(u"spinBoxDownloadsPerHost")
+        self.spinBoxDownloadsPerHost.setMinimum(1)
+        self.spinBoxDownloadsPerHost.setMaximum(64)
+        self.spinBoxDownloadsPerHost.setValue(8)
+
+        self.formLayout.setWidget(3, QFormLayout.FieldRole, self.spinBoxDownloadsPerHost)
+
+        self.label4 = QLabel(self.configGroupBox)
+        self.label4.setObjectName(u"label4")
+
+        self.formLayout.setWidget(4, QFormLayout.LabelRole, self.label4)
+
+        self.checkBoxAsyncioDownloads = QCheckBox(self.configGroupBox)
+        self.checkBoxAsyncioDownloads.setObjectName(u"checkBoxAsyncioDownloads")
+
+        self.formLayout.setWidget(4, QFormLayout.FieldRole, self.checkBoxAsyncioDownloads)
+
+        self.label5 = QLabel(self.configGroupBox)
+        self.label5.setObjectName(u"label5")
+
+        self.formLayout.setWidget(5, QFormLayout.LabelRole, self.label5)
+
+        self.comboBoxFileBrowserSource = QComboBox(self.configGroupBox)
+        self.comboBoxFileBrowserSource.addItem("")
+        self.comboBoxFileBrowserSource.addItem("")
+        self.comboBoxFileBrowserSource.setObjectName(u"comboBoxFileBrowserSource")
+
+        self.formLayout.setWidget(5, QFormLayout.FieldRole, self.comboBoxFileBrowserSource)
+
 
         self.gridLayout.addWidget(self.configGroupBox, 0, 0, 1, 1)
 
@@ -86,5 +134,25 @@ class Ui_ConfigureDialog(object):
         self.label0.setText(QCoreApplication.translate("ConfigureDialog", u"Identifier:", None))
         self.label1.setText(QCoreApplication.translate("ConfigureDialog", u"Output directory:", None))
         self.pushButtonOutputDirectory.setText(QCoreApplication.translate("ConfigureDialog", u"...", None))
+#if QT_CONFIG(tooltip)
+        self.label2.setToolTip(QCoreApplication.translate("ConfigureDialog", u"Maximum number of files downloaded at the same time", None))
+#endif // QT_CONFIG(tooltip)
+        self.label2.setText(QCoreApplication.translate("ConfigureDialog", u"Concurrent downloads:", None))
+#if QT_CONFIG(tooltip)
+        self.label3.setToolTip(QCoreApplication.translate("ConfigureDialog", u"Maximum number of files downloaded from the same server at the same time", None))
+#endif // QT_CONFIG(tooltip)
+        self.label3.setText(QCoreApplication.translate("ConfigureDialog", u"Downloads per host:", None))
+#if QT_CONFIG(tooltip)
+        self.label4.setToolTip(QCoreApplication.translate("ConfigureDialog", u"Download on a single event loop, allowing hundreds of downloads at the same time (requires aiohttp)", None))
+#endif // QT_CONFIG(tooltip)
+        self.label4.setText(QCoreApplication.translate("ConfigureDialog", u"Event loop downloads:", None))
+        self.checkBoxAsyncioDownloads.setText("")
+#if QT_CONFIG(tooltip)
+        self.label5.setToolTip(QCoreApplication.translate("ConfigureDialog", u"List the downloaded files from the output directory or, without scanning the output directory, from the download manifest", None))
+#endif // QT_CONFIG(tooltip)
+        self.label5.setText(QCoreApplication.translate("ConfigureDialog", u"File browser:", None))
+        self.comboBoxFileBrowserSource.setItemText(0, QCoreApplication.translate("ConfigureDialog", u"Output directory", None))
+        self.comboBoxFileBrowserSource.setItemText(1, QCoreApplication.translate("ConfigureDialog", u"Download manifest", None))
+
     # retranslateUi
 
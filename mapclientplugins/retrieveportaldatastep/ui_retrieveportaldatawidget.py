@@ -15,7 +15,7 @@ from PySide6.QtGui import (QBrush, QColor, QConicalGradient, QCursor,
     QFont, QFontDatabase, QGradient, QIcon,
     QImage, QKeySequence, QLinearGradient, QPainter,
     QPalette, QPixmap, QRadialGradient, QTransform)
-from PySide6.QtWidgets import (QAbstractItemView, QApplication, QComboBox, QFrame,
+from PySide6.QtWidgets import (QAbstractItemView, QApplication, QCheckBox, QComboBox, QFrame,
     QGridLayout, QGroupBox, QHBoxLayout, QHeaderView,
     QLabel, QLineEdit, QListView, QPushButton,
     QSizePolicy, QSpacerItem, QTableView, QToolButton,
@@ -110,6 +110,16 @@ class Ui_RetrievePortalDataWidget(object):
 
         self.horizontalLayout_2.addWidget(self.pushButtonSearch)
 
+        self.pushButtonCancelSearch = QPushButton(self.manifestGroupBox)
+        self.pushButtonCancelSearch.setObjectName(u"pushButtonCancelSearch")
+
+        self.horizontalLayout_2.addWidget(self.pushButtonCancelSearch)
+
+        self.checkBoxOffline = QCheckBox(self.manifestGroupBox)
+        self.checkBoxOffline.setObjectName(u"checkBoxOffline")
+
+        self.horizontalLayout_2.addWidget(self.checkBoxOffline)
+
         self.horizontalSpacer_2 = QSpacerItem(40, 20, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum)
 
         self.horizontalLayout_2.addItem(self.horizontalSpacer_2)
@@ -198,6 +208,12 @@ class Ui_RetrievePortalDataWidget(object):
 
         self.verticalLayout_2.addWidget(self.tableViewSearchResult)
 
+        self.labelSearchStatus = QLabel(self.groupBox)
+        self.labelSearchStatus.setObjectName(u"labelSearchStatus")
+        self.labelSearchStatus.setWordWrap(True)
+
+        self.verticalLayout_2.addWidget(self.labelSearchStatus)
+
 
         self.verticalLayout_9.addWidget(self.groupBox)
 
@@ -342,6 +358,14 @@ class Ui_RetrievePortalDataWidget(object):
         self.comboBoxSearchBy.setItemText(2, QCoreApplication.translate("RetrievePortalDataWidget", u"mimetype", None))
 
         self.pushButtonSearch.setText(QCoreApplication.translate("RetrievePortalDataWidget", u"Search", None))
+#if QT_CONFIG(tooltip)
+        self.pushButtonCancelSearch.setToolTip(QCoreApplication.translate("RetrievePortalDataWidget", u"Stop retrieving results for the current search", None))
+#endif // QT_CONFIG(tooltip)
+        self.pushButtonCancelSearch.setText(QCoreApplication.translate("RetrievePortalDataWidget", u"Cancel", None))
+#if QT_CONFIG(tooltip)
+        self.checkBoxOffline.setToolTip(QCoreApplication.translate("RetrievePortalDataWidget", u"Only show results from previous searches, without contacting the portal", None))
+#endif // QT_CONFIG(tooltip)
+        self.checkBoxOffline.setText(QCoreApplication.translate("RetrievePortalDataWidget", u"Offline", None))
         self.groupBoxRestrictTo.setTitle(QCoreApplication.translate("RetrievePortalDataWidget", u"Restrict to:", None))
 #if QT_CONFIG(tooltip)
         self.labelDatasetID.setToolTip(QCoreApplication.translate("RetrievePortalDataWidget", u"Restrict the search to the dataset with ID specified here", None))
@@ -0,0 +1,165 @@
+"""
+Extract a zip archive while it is being received.
+
+The members of an archive are read from their local file headers as the
+bytes arrive, so the archive never has to be held in memory or written to
+disk before it can be unpacked.  Stored and deflated members are supported,
+including members whose sizes are only given in a trailing data descriptor.
+"""
+import struct
+import zlib
+
+LOCAL_FILE_HEADER_SIGNATURE = b'PK\x03\x04'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+ZIP64_EXTRA_FIELD_ID = 0x0001
+READ_SIZE = 64 * 1024
+
+_FLAG_ENCRYPTED = 0x01
+_FLAG_DATA_DESCRIPTOR = 0x08
+_FLAG_UTF8 = 0x800
+_METHOD_STORED = 0
+_METHOD_DEFLATED = 8
+
+
+class UnsupportedZipStream(Exception):
+    pass
+
+
+class _ChunkReader(object):
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+
+    def _fill(self, size):
+        while len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return False
+            self._buffer.extend(chunk)
+
+        return True
+
+    def read_exact(self, size):
+        if not self._fill(size):
+            raise EOFError("Zip stream ended unexpectedly.")
+
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def read_some(self, max_size):
+        if not self._buffer and not self._fill(1):
+            return b''
+
+        data = bytes(self._buffer[:max_size])
+        del self._buffer[:max_size]
+        return data
+
+    def peek_exact(self, size):
+        if not self._fill(size):
+            return b''
+
+        return bytes(self._buffer[:size])
+
+    def unread(self, data):
+        self._buffer[:0] = data
+
+
+def _zip64_sizes(extra, compressed_size, uncompressed_size):
+    offset = 0
+    while offset + 4 <= len(extra):
+        field_id, field_size = struct.unpack_from('<HH', extra, offset)
+        offset += 4
+        if field_id == ZIP64_EXTRA_FIELD_ID:
+            values = list(struct.unpack_from(f'<{field_size // 8}Q', extra, offset))
+            if uncompressed_size == 0xFFFFFFFF and values:
+                uncompressed_size = values.pop(0)
+            if compressed_size == 0xFFFFFFFF and values:
+                compressed_size = values.pop(0)
+            return compressed_size, uncompressed_size, True
+        offset += field_size
+
+    return compressed_size, uncompressed_size, False
+
+
+def _copy_stored(reader, size, sink):
+    crc = 0
+    remaining = size
+    while remaining:
+        data = reader.read_some(min(READ_SIZE, remaining))
+        if not data:
+            raise EOFError("Zip stream ended unexpectedly.")
+        remaining -= len(data)
+        crc = zlib.crc32(data, crc)
+        if sink is not None:
+            sink.write(data)
+
+    return crc
+
+
+def _inflate(reader, sink):
+    crc = 0
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    while not decompressor.eof:
+        data = reader.read_some(READ_SIZE)
+        if not data:
+            raise EOFError("Zip stream ended unexpectedly.")
+        output = decompressor.decompress(data)
+        crc = zlib.crc32(output, crc)
+        if sink is not None:
+            sink.write(output)
+
+    # Bytes following the end of the deflate stream belong to the next record.
+    reader.unread(decompressor.unused_data)
+    return crc
+
+
+def _read_data_descriptor(reader, zip64):
+    if reader.peek_exact(4) == DATA_DESCRIPTOR_SIGNATURE:
+        reader.read_exact(4)
+    crc, = struct.unpack('<I', reader.read_exact(4))
+    reader.read_exact(16 if zip64 else 8)
+    return crc
+
+
+def extract_zip_stream(chunks, open_member):
+    """
+    Generator extracting the members of a zip archive from an iterable of byte chunks.
+    Yields (name, crc_valid) for each member once it has been written completely.
+
+    :param chunks: Iterable of bytes making up the archive.
+    :param open_member: Callable taking a member name and returning a writable binary file,
+        or None to skip the member.  The caller is responsible for closing the file.
+    """
+    reader = _ChunkReader(chunks)
+    while True:
+        if reader.peek_exact(4) != LOCAL_FILE_HEADER_SIGNATURE:
+            # Either the end of the stream or the start of the central directory.
+            return
+
+        reader.read_exact(4)
+        (_, flags, method, _, _, crc, compressed_size, uncompressed_size,
+         name_length, extra_length) = struct.unpack('<HHHHHIIIHH', reader.read_exact(26))
+        raw_name = reader.read_exact(name_length)
+        name = raw_name.decode('utf-8' if flags & _FLAG_UTF8 else 'cp437')
+        extra = reader.read_exact(extra_length)
+        compressed_size, uncompressed_size, zip64 = _zip64_sizes(extra, compressed_size, uncompressed_size)
+
+        if flags & _FLAG_ENCRYPTED:
+            raise UnsupportedZipStream(f"Encrypted member '{name}' is not supported.")
+
+        has_data_descriptor = flags & _FLAG_DATA_DESCRIPTOR
+        sink = None if name.endswith('/') else open_member(name)
+        if method == _METHOD_DEFLATED:
+            actual_crc = _inflate(reader, sink)
+        elif method == _METHOD_STORED and not (has_data_descriptor and compressed_size == 0):
+            actual_crc = _copy_stored(reader, compressed_size, sink)
+        else:
+            raise UnsupportedZipStream(f"Member '{name}' cannot be extracted while streaming.")
+
+        if has_data_descriptor:
+            crc = _read_data_descriptor(reader, zip64)
+
+        if sink is not None:
+            yield name, actual_crc == crc